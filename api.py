@@ -1,6 +1,9 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel, Field
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+import json
+from collections import Counter
 import os
 import tempfile
 import shutil
@@ -9,21 +12,77 @@ import boto3
 from botocore.exceptions import ClientError
 from dotenv import load_dotenv
 import uuid
+import time
 from urllib.parse import urlparse
+from functools import lru_cache
 
 from utils import (
-    pdf_to_images,
-    encode_image,
-    process_images_in_batches,
+    resolution_policy_from_env,
+    get_page_count,
+    extract_pdf,
     merge_data,
-    merge_soil_and_sample_data
+    merge_soil_and_sample_data,
+    DEFAULT_MAX_CONCURRENCY,
+    DEFAULT_EXTRACTION_MODE
 )
-from pydantic_models import MetadataAndSoilData, MetadataAndSampleData
+from pydantic_models import MetadataAndSoilData, MetadataAndSampleData, Borehole
+from clients import client_manager
+from page_cache import page_cache
+from jobs import JobStore
+from limiter import AdaptiveLimiter
+from vllm_metrics import metrics_url_for, fetch_combined_metrics, prefix_cache_stats
+from backends import BackendPool
+from telemetry import stage, render_metrics, CONCURRENCY_LIMIT, PDFS
+from usage import summarize_calls, combine_summaries, usage_log
+from merger import IncrementalMerger
 
 # Load environment variables
 load_dotenv()
 base_url = os.getenv("BASE_URL", "")
 api_key = os.getenv("API_KEY", "")
+# Comma-separated OpenAI-compatible endpoints to balance model calls over (one vLLM server
+# per GPU node); BASE_URL alone is used when unset
+backend_urls = [url.strip() for url in os.getenv("BACKEND_URLS", "").split(",") if url.strip()]
+model_backend = BackendPool(backend_urls, api_key) if backend_urls else base_url
+max_concurrency = int(os.getenv("MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY))
+# "two_call" (soil and sample prompts separately) or "combined" (one call per page)
+extraction_mode = os.getenv("EXTRACTION_MODE", DEFAULT_EXTRACTION_MODE)
+# Skip non-drill-log pages and route map pages to borehole map extraction (CLASSIFY_PAGES=0 disables)
+classify_pages = os.getenv("CLASSIFY_PAGES", "1") != "0"
+# Read page metadata from the PDF text layer when present (USE_TEXT_LAYER=0 disables)
+use_text_layer = os.getenv("USE_TEXT_LAYER", "1") != "0"
+# Ask for metadata only on the first page of each borehole (REUSE_HOLE_METADATA=1 enables)
+reuse_hole_metadata = os.getenv("REUSE_HOLE_METADATA", "0") == "1"
+# Send a page's second call once the first is prefilled so it hits vLLM's prefix cache
+# (PAIR_PAGE_CALLS=0 sends both at once)
+pair_page_calls = os.getenv("PAIR_PAGE_CALLS", "1") != "0"
+# Page render width defaults to 4000px; see resolution_policy_from_env for the overrides
+resolution_policy = resolution_policy_from_env(4000)
+# Set to a directory to also dump every rendered page as a .jpg for debugging
+debug_image_dir = os.getenv("DEBUG_IMAGE_DIR") or None
+
+# In-flight model calls are capped process-wide, across every PDF and request. By default
+# the cap adapts (AIMD) between 1 and MAX_CONCURRENCY_LIMIT starting at MAX_CONCURRENCY;
+# ADAPTIVE_CONCURRENCY=0 keeps it fixed at MAX_CONCURRENCY
+adaptive_concurrency = os.getenv("ADAPTIVE_CONCURRENCY", "1") != "0"
+if adaptive_concurrency:
+    model_call_limiter = AdaptiveLimiter(
+        initial_limit=max_concurrency, max_limit=int(os.getenv("MAX_CONCURRENCY_LIMIT", 64))
+    )
+    # Pages are still admitted per PDF for the initial limit (MAX_CONCURRENCY). Admitting
+    # for max_limit would keep that many rendered pages waiting on the shared limiter in
+    # every PDF; MAX_CONCURRENT_PDFS PDFs together are what fill a raised limit
+else:
+    model_call_limiter = asyncio.Semaphore(max_concurrency)
+# PDFs extracted at the same time across all requests and jobs; the others wait after their
+# download. Every extracting PDF holds rendered pages and a window of model calls in memory
+max_concurrent_pdfs = int(os.getenv("MAX_CONCURRENT_PDFS", 4))
+pdf_extraction_slots = asyncio.Semaphore(max_concurrent_pdfs)
+# vLLM /metrics URLs (comma-separated) for the adaptive cap's queue depth and prefix-cache
+# hit rates; "auto" derives one per backend from BACKEND_URLS or BASE_URL
+vllm_metrics_urls = [url.strip() for url in os.getenv("VLLM_METRICS_URL", "").split(",") if url.strip()]
+if vllm_metrics_urls == ["auto"]:
+    vllm_metrics_urls = [metrics_url_for(url) for url in backend_urls or [base_url]]
 
 # AWS S3 Configuration
 aws_access_key_id = os.getenv("AWS_ACCESS_KEY_ID")
@@ -36,10 +95,34 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Background jobs for the asynchronous API; JOB_WORKERS jobs run at the same time
+job_store = JobStore(max_workers=int(os.getenv("JOB_WORKERS", 2)), ttl=float(os.getenv("JOB_TTL", 3600)))
+
+@app.on_event("startup")
+async def start_job_workers():
+    """Start the job worker pool and vLLM metrics polling"""
+    job_store.start(run_job)
+    if isinstance(model_backend, BackendPool):
+        model_backend.start()
+    if adaptive_concurrency and vllm_metrics_urls:
+        model_call_limiter.watch_metrics(vllm_metrics_urls)
+
+@app.on_event("shutdown")
+async def close_model_clients():
+    """Stop job workers, close pooled model clients and flush the page cache on shutdown"""
+    await job_store.stop()
+    if adaptive_concurrency:
+        await model_call_limiter.close()
+    if isinstance(model_backend, BackendPool):
+        await model_backend.close()
+    await client_manager.aclose()
+    await asyncio.to_thread(page_cache.flush)
+
 class ProcessRequest(BaseModel):
     s3_urls: List[str] = Field(..., description="List of S3 URLs pointing to PDF files")
     pdf_id: str = Field(..., description="Unique identifier for this PDF processing batch")
     user_id: str = Field(..., description="User identifier")
+    bypass_cache: bool = Field(False, description="Ignore cached page results and re-run every model call")
 
 class BoreholeData(BaseModel):
     hole_no: str
@@ -48,6 +131,10 @@ class BoreholeData(BaseModel):
     soil_data: List[Dict[str, Any]]
     source_pdf_url: str
 
+class MapBoreholeData(Borehole):
+    # A borehole listed on a boring location map page (name, number and excavation level)
+    source_pdf_url: str
+
 class ProcessResponse(BaseModel):
     pdf_id: str
     user_id: str
@@ -55,8 +142,25 @@ class ProcessResponse(BaseModel):
     total_pdfs_processed: int
     total_boreholes_found: int
     boreholes: List[BoreholeData]
+    map_boreholes: List[MapBoreholeData] = []
     processing_summary: Dict[str, Any]
 
+class JobSubmitResponse(BaseModel):
+    job_id: str
+    status: str
+    status_url: str
+    results_url: str
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    pdf_id: str
+    user_id: str
+    status: str
+    pdfs: List[Dict[str, Any]]
+    boreholes_found: int
+    map_boreholes_found: int
+    processing_summary: Optional[Dict[str, Any]]
+
 def create_s3_client():
     """Create and return S3 client"""
     return boto3.client(
@@ -66,6 +170,11 @@ def create_s3_client():
         region_name=aws_region
     )
 
+@lru_cache(maxsize=None)
+def get_s3_client():
+    """Shared S3 client; boto3 clients are thread-safe and building one resolves credentials"""
+    return create_s3_client()
+
 def parse_s3_url(s3_url: str) -> tuple:
     """Parse S3 URL to extract bucket and key"""
     parsed = urlparse(s3_url)
@@ -79,10 +188,11 @@ def parse_s3_url(s3_url: str) -> tuple:
 async def download_pdf_from_s3(s3_url: str, local_path: str) -> bool:
     """Download PDF from S3 to local path"""
     try:
-        s3_client = create_s3_client()
         bucket, key = parse_s3_url(s3_url)
+        s3_client = await asyncio.to_thread(get_s3_client)
         
-        s3_client.download_file(bucket, key, local_path)
+        # boto3 is blocking; run it off the event loop so other PDFs keep going
+        await asyncio.to_thread(s3_client.download_file, bucket, key, local_path)
         return True
     except ClientError as e:
         print(f"Error downloading {s3_url}: {e}")
@@ -91,54 +201,115 @@ async def download_pdf_from_s3(s3_url: str, local_path: str) -> bool:
         print(f"Unexpected error downloading {s3_url}: {e}")
         return False
 
-async def process_single_pdf(s3_url: str, temp_dir: str) -> tuple:
-    """Process a single PDF and return extracted data"""
+async def process_single_pdf(s3_url: str, temp_dir: str, use_cache: bool = True,
+                             progress: Optional[dict] = None, call_log: Optional[list] = None,
+                             on_borehole=None) -> tuple:
+    """Process a single PDF and return extracted data, map boreholes, an error and per-stage timings
+
+    Map boreholes are the Borehole dicts read from boring location map pages; a PDF with
+    only map pages succeeds with empty extracted data. If given, progress is updated in
+    place with status, pages_total and pages_done, and call_log collects the usage record
+    of every model call. on_borehole(borehole) is awaited for each merged borehole as soon
+    as its last page is extracted, and again with all its pages when more of them turn up
+    later in the PDF.
+    """
+    timings = {"s3_url": s3_url}
+    progress = progress if progress is not None else {}
+    page_results = {}
+    merger = IncrementalMerger()
+    publishing = []
+
+    def publish(boreholes):
+        # Tasks start in order and Job.add_boreholes takes a FIFO lock, so order is kept
+        if on_borehole:
+            publishing.extend(asyncio.create_task(on_borehole(borehole)) for borehole in boreholes)
+
+    def on_page_result(page_index, kind, result):
+        publish(merger.add(page_index, kind, result))
+
+    def on_result(page_index, kind):
+        # A page is done once both its soil and sample results are in
+        page_results[page_index] = page_results.get(page_index, 0) + 1
+        if page_results[page_index] == 2:
+            progress["pages_done"] = progress.get("pages_done", 0) + 1
+
+    start = time.perf_counter()
     try:
         # Create filename from S3 URL
         filename = os.path.basename(urlparse(s3_url).path)
         if not filename.endswith('.pdf'):
             filename += '.pdf'
         
-        pdf_path = os.path.join(temp_dir, filename)
+        # PDFs are processed concurrently, so give each download its own path
+        pdf_path = os.path.join(temp_dir, f"{uuid.uuid4().hex}_{filename}")
         
         # Download PDF from S3
-        success = await download_pdf_from_s3(s3_url, pdf_path)
+        progress["status"] = "downloading"
+        with stage("download"):
+            success = await download_pdf_from_s3(s3_url, pdf_path)
+        timings["download_s"] = round(time.perf_counter() - start, 3)
         if not success:
-            return None, f"Failed to download PDF from {s3_url}"
+            return None, [], f"Failed to download PDF from {s3_url}", timings
         
-        # Create output directory for images
-        output_dir = os.path.join(temp_dir, f"{filename}_images")
-        os.makedirs(output_dir, exist_ok=True)
+        def on_page_types(page_types):
+            if page_types is not None:
+                progress["pages_total"] = page_types.count("table")
+                timings["page_types"] = dict(Counter(page_types))
         
-        # Convert PDF to images
-        pdf_to_images(pdf_path, output_dir, fixed_length=4000, max_workers=4)
+        # Classify pages, then render drill-log pages off the event loop and stream them
+        # into the model calls as each one is ready; map pages are extracted alongside
+        progress["status"] = "waiting"
+        page_errors = []
+        timings["page_errors"] = page_errors
+        async with pdf_extraction_slots:
+            progress["status"] = "extracting"
+            progress["pages_total"] = await asyncio.to_thread(get_page_count, pdf_path)
+            stage_start = time.perf_counter()
+            with stage("extraction"):
+                soil_data, sample_data, map_data, _ = await extract_pdf(
+                    pdf_path, model_backend, api_key, policy=resolution_policy, classify_pages=classify_pages,
+                    use_text_layer=use_text_layer, reuse_hole_metadata=reuse_hole_metadata, max_concurrency=max_concurrency, extraction_mode=extraction_mode,
+                    use_cache=use_cache, call_limiter=model_call_limiter, on_result=on_result,
+                    on_page_types=on_page_types, page_errors=page_errors, pair_calls=pair_page_calls,
+                    call_log=call_log, on_page_result=on_page_result, debug_dir=debug_image_dir,
+                    base_name=os.path.splitext(filename)[0]
+                )
+        timings["extraction_s"] = round(time.perf_counter() - stage_start, 3)
+        timings["pages"] = len(soil_data)
+        map_boreholes = [borehole for page in map_data for borehole in page["metadata"]]
+        publish(merger.finish())
         
-        # Get image files
-        image_files = sorted([
-            os.path.join(output_dir, f) 
-            for f in os.listdir(output_dir) 
-            if f.lower().endswith((".png", ".jpg", ".jpeg"))
-        ])
-        
-        if not image_files:
-            return None, f"No images could be extracted from {filename}"
-        
-        # Encode images to base64
-        image_base64_list = [encode_image(image_path) for image_path in image_files]
-        
-        # Process images through the model
-        soil_data, sample_data = await process_images_in_batches(
-            image_base64_list, base_url, api_key
-        )
+        if not soil_data:
+            if map_boreholes:
+                return [], map_boreholes, None, timings
+            return None, [], f"No drill-log pages could be extracted from {filename}", timings
         
         # Merge parsed data
-        merged_soil_data, merged_sample_data = merge_data(soil_data, sample_data, debug=True)
-        final_data = merge_soil_and_sample_data(merged_soil_data, merged_sample_data)
+        progress["status"] = "merging"
+        stage_start = time.perf_counter()
+        with stage("merge"):
+            merged_soil_data, merged_sample_data = merge_data(soil_data, sample_data, debug=True)
+            final_data = merge_soil_and_sample_data(merged_soil_data, merged_sample_data)
+        timings["merge_s"] = round(time.perf_counter() - stage_start, 3)
         
-        return final_data, None
+        return final_data, map_boreholes, None, timings
         
     except Exception as e:
-        return None, f"Error processing {s3_url}: {str(e)}"
+        return None, [], f"Error processing {s3_url}: {str(e)}", timings
+    
+    finally:
+        await asyncio.gather(*publishing, return_exceptions=True)
+        timings["total_s"] = round(time.perf_counter() - start, 3)
+
+async def read_vllm_metrics() -> Optional[Dict[str, float]]:
+    """Current vLLM metrics, or None when VLLM_METRICS_URL is unset or unreachable"""
+    if not vllm_metrics_urls:
+        return None
+    try:
+        return await fetch_combined_metrics(vllm_metrics_urls)
+    except Exception as e:
+        print(f"Could not read vLLM metrics from {vllm_metrics_urls}: {e}")
+        return None
 
 def organize_data_by_borehole(all_pdf_data: List[tuple]) -> List[BoreholeData]:
     """Organize extracted data by borehole across all PDFs"""
@@ -162,6 +333,105 @@ def organize_data_by_borehole(all_pdf_data: List[tuple]) -> List[BoreholeData]:
     
     return boreholes
 
+async def process_request_pdfs(request: ProcessRequest, on_pdf_done=None,
+                               progress: Optional[Dict[str, dict]] = None, on_borehole=None) -> tuple:
+    """Process every PDF of a request concurrently and return (results, map_boreholes, processing_summary)
+
+    on_pdf_done(pdf_data, map_boreholes, s3_url) is awaited as soon as each PDF finishes
+    successfully, and on_borehole(borehole, s3_url) as soon as each borehole's last page is
+    extracted. map_boreholes is a list of MapBoreholeData over every PDF.
+    progress maps each S3 URL to a dict that is updated as the PDF moves through the stages.
+    """
+    temp_dir = tempfile.mkdtemp(prefix=f"drill_logs_{request.pdf_id}_")
+    
+    async def run_pdf(s3_url):
+        pdf_progress = progress.get(s3_url) if progress is not None else None
+        call_log = []
+        
+        async def publish_borehole(borehole):
+            await on_borehole(borehole, s3_url)
+        
+        # One trace span per PDF; its stages, pages and model calls are nested under it
+        with stage("pdf", s3_url=s3_url, pdf_id=request.pdf_id):
+            pdf_data, map_boreholes, error, timings = await process_single_pdf(
+                s3_url, temp_dir, use_cache=not request.bypass_cache, progress=pdf_progress, call_log=call_log,
+                on_borehole=publish_borehole if on_borehole else None
+            )
+        PDFS.labels("failed" if error else "completed").inc()
+        timings["usage"] = summarize_calls(call_log)
+        if usage_log.enabled:
+            await asyncio.to_thread(
+                usage_log.write, call_log, pdf_id=request.pdf_id, user_id=request.user_id, s3_url=s3_url
+            )
+        if pdf_progress is not None:
+            pdf_progress["status"] = "failed" if error else "completed"
+            pdf_progress["error"] = error
+        if not error and on_pdf_done:
+            await on_pdf_done(pdf_data, map_boreholes, s3_url)
+        return pdf_data, map_boreholes, error, timings
+    
+    try:
+        metrics_before = await read_vllm_metrics()
+        # Process all PDFs concurrently; model calls share model_call_limiter
+        start = time.perf_counter()
+        outcomes = await asyncio.gather(
+            *(run_pdf(s3_url) for s3_url in request.s3_urls),
+            return_exceptions=True
+        )
+        wall_time = time.perf_counter() - start
+        
+        results = []
+        map_boreholes = []
+        errors = []
+        page_errors = []
+        pdf_timings = []
+        
+        for s3_url, outcome in zip(request.s3_urls, outcomes):
+            if isinstance(outcome, Exception):
+                errors.append(f"{s3_url}: {str(outcome)}")
+                continue
+            pdf_data, pdf_map_boreholes, error, timings = outcome
+            pdf_timings.append(timings)
+            map_boreholes.extend(
+                MapBoreholeData(**borehole, source_pdf_url=s3_url) for borehole in pdf_map_boreholes
+            )
+            page_errors.extend({"s3_url": s3_url, **record} for record in timings.get("page_errors", []))
+            if error:
+                errors.append(f"{s3_url}: {error}")
+            else:
+                results.append((pdf_data, s3_url))
+        
+        # Create processing summary
+        processing_summary = {
+            "total_s3_urls": len(request.s3_urls),
+            "successfully_processed": len(results),
+            "failed_processing": len(errors),
+            "errors": errors,
+            # Pages that failed after retries; the rest of their PDF was still extracted
+            "page_errors": page_errors,
+            "processing_time_info": f"Completed using Qwen2.5-VL-32B {extraction_mode} extraction",
+            "page_cache": await asyncio.to_thread(page_cache.stats),
+            # Tokens, calls and latency over every PDF, by prompt; per-page detail is in pdf_timings
+            "usage": combine_summaries([timings["usage"] for timings in pdf_timings if "usage" in timings]),
+            "wall_time_s": round(wall_time, 3),
+            "pdf_timings": pdf_timings
+        }
+        if metrics_before is not None:
+            # Server-wide counters, so requests running at the same time are included too
+            metrics_after = await read_vllm_metrics()
+            if metrics_after is not None:
+                processing_summary["prefix_cache"] = prefix_cache_stats(metrics_after, metrics_before)
+        
+        return results, map_boreholes, processing_summary
+    
+    finally:
+        # Clean up temporary directory
+        if os.path.exists(temp_dir):
+            try:
+                shutil.rmtree(temp_dir)
+            except Exception as e:
+                print(f"Warning: Could not clean up temp directory {temp_dir}: {e}")
+
 @app.post("/api/v1/process-drill-logs", response_model=ProcessResponse)
 async def process_drill_logs(request: ProcessRequest):
     """
@@ -177,44 +447,12 @@ async def process_drill_logs(request: ProcessRequest):
     if not request.s3_urls:
         raise HTTPException(status_code=400, detail="No S3 URLs provided")
     
-    temp_dir = None
-    
     try:
-        # Create temporary directory
-        temp_dir = tempfile.mkdtemp(prefix=f"drill_logs_{request.pdf_id}_")
-        
-        # Process all PDFs concurrently
-        tasks = []
-        for s3_url in request.s3_urls:
-            task = process_single_pdf(s3_url, temp_dir)
-            tasks.append((task, s3_url))
-        
-        # Wait for all processing to complete
-        results = []
-        errors = []
-        
-        for task, s3_url in tasks:
-            try:
-                pdf_data, error = await task
-                if error:
-                    errors.append(f"{s3_url}: {error}")
-                else:
-                    results.append((pdf_data, s3_url))
-            except Exception as e:
-                errors.append(f"{s3_url}: {str(e)}")
+        results, map_boreholes, processing_summary = await process_request_pdfs(request)
         
         # Organize data by borehole
         boreholes = organize_data_by_borehole(results)
         
-        # Create processing summary
-        processing_summary = {
-            "total_s3_urls": len(request.s3_urls),
-            "successfully_processed": len(results),
-            "failed_processing": len(errors),
-            "errors": errors,
-            "processing_time_info": "Completed using Qwen2.5-VL-32B two-step extraction"
-        }
-        
         return ProcessResponse(
             pdf_id=request.pdf_id,
             user_id=request.user_id,
@@ -222,31 +460,107 @@ async def process_drill_logs(request: ProcessRequest):
             total_pdfs_processed=len(results),
             total_boreholes_found=len(boreholes),
             boreholes=boreholes,
+            map_boreholes=map_boreholes,
             processing_summary=processing_summary
         )
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Processing failed: {str(e)}")
+
+async def run_job(job):
+    """Process a queued job, publishing each borehole as soon as its last page is extracted
+
+    A borehole published again replaces its earlier entry (see Job.add_boreholes). Map
+    boreholes are published once their PDF is done.
+    """
+    async def publish(borehole, s3_url):
+        boreholes = organize_data_by_borehole([([borehole], s3_url)])
+        await job.add_boreholes([borehole.model_dump() for borehole in boreholes])
     
-    finally:
-        # Clean up temporary directory
-        if temp_dir and os.path.exists(temp_dir):
-            try:
-                shutil.rmtree(temp_dir)
-            except Exception as e:
-                print(f"Warning: Could not clean up temp directory {temp_dir}: {e}")
+    async def publish_map_boreholes(pdf_data, map_boreholes, s3_url):
+        await job.add_map_boreholes([
+            MapBoreholeData(**borehole, source_pdf_url=s3_url).model_dump() for borehole in map_boreholes
+        ])
+    
+    results, _, processing_summary = await process_request_pdfs(
+        job.request, on_pdf_done=publish_map_boreholes, progress=job.pdfs, on_borehole=publish
+    )
+    await job.set_status("completed" if results else "failed", processing_summary)
+
+@app.post("/api/v1/jobs", response_model=JobSubmitResponse, status_code=202)
+async def submit_job(request: ProcessRequest):
+    """
+    Queue drill-log processing and return a job id immediately.
+    
+    Poll /api/v1/jobs/{job_id} for progress and read /api/v1/jobs/{job_id}/results
+    to stream boreholes as each one finishes.
+    """
+    if not request.s3_urls:
+        raise HTTPException(status_code=400, detail="No S3 URLs provided")
+    
+    job = job_store.submit(request)
+    return JobSubmitResponse(
+        job_id=job.job_id,
+        status=job.status,
+        status_url=f"/api/v1/jobs/{job.job_id}",
+        results_url=f"/api/v1/jobs/{job.job_id}/results"
+    )
+
+@app.get("/api/v1/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_job_status(job_id: str):
+    """Report job status with per-PDF page progress"""
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return JobStatusResponse(**job.to_status())
+
+@app.get("/api/v1/jobs/{job_id}/results")
+async def stream_job_results(job_id: str):
+    """
+    Stream job results as NDJSON.
+    
+    Every line is {"event": "borehole", "data": {...}} as soon as its last page is extracted,
+    {"event": "borehole_updated", "data": {...}} with the whole borehole again when more of
+    its pages turn up later in the PDF (same source_pdf_url and hole_no), or {"event":
+    "map_borehole", "data": {...}} for a borehole listed on a location map once its PDF is
+    done, followed by one {"event": "completed" | "failed", "data": processing_summary} line.
+    """
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    
+    async def ndjson_lines():
+        async for event, data in job.stream_events():
+            yield json.dumps({"event": event, "data": data}, ensure_ascii=False) + "\n"
+        yield json.dumps({"event": job.status, "data": job.processing_summary}, ensure_ascii=False) + "\n"
+    
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
 
 @app.get("/api/v1/health")
 async def health_check():
     """Health check endpoint"""
+    metrics = await read_vllm_metrics()
     return {
         "status": "healthy",
         "service": "Drill Log Data Extraction API",
         "version": "1.0.0",
         "model": "Qwen2.5-VL-32B-Instruct",
-        "extraction_method": "Two-step schema extraction"
+        "extraction_method": extraction_mode,
+        "reuse_hole_metadata": reuse_hole_metadata,
+        "concurrency": model_call_limiter.stats() if adaptive_concurrency else {"limit": max_concurrency},
+        "pair_page_calls": pair_page_calls,
+        "backends": model_backend.stats() if isinstance(model_backend, BackendPool) else [{"base_url": base_url}],
+        "prefix_cache": prefix_cache_stats(metrics) if metrics else None,
+        "page_cache": await asyncio.to_thread(page_cache.stats)
     }
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: stage and model call latency, tokens, cache lookups, errors"""
+    CONCURRENCY_LIMIT.set(model_call_limiter.stats()["limit"] if adaptive_concurrency else max_concurrency)
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
 @app.get("/")
 async def root():
     """Root endpoint with API information"""
@@ -254,8 +568,10 @@ async def root():
         "message": "Drill Log Data Extraction API",
         "version": "1.0.0",
         "endpoint": "/api/v1/process-drill-logs",
+        "jobs_endpoint": "/api/v1/jobs",
         "docs": "/docs",
-        "health": "/api/v1/health"
+        "health": "/api/v1/health",
+        "metrics": "/metrics"
     }
 
 if __name__ == "__main__":
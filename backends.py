@@ -0,0 +1,161 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+import httpx
+import openai
+
+# A backend is ejected after this many consecutive failed calls, for EJECT_SECONDS at
+# first and twice as long each time it fails again right after coming back
+EJECT_AFTER_FAILURES = 3
+EJECT_SECONDS = 30.0
+MAX_EJECT_SECONDS = 600.0
+# How often GET /models is sent to every backend by the health checker
+HEALTH_CHECK_INTERVAL = 10.0
+HEALTH_CHECK_TIMEOUT = 5.0
+# Pages remembered for affinity, so both calls of a page go to the same server
+MAX_AFFINITY_KEYS = 4096
+
+
+def is_backend_failure(error) -> bool:
+    # The server is down or broken, as opposed to busy (429) or given a bad request
+    if isinstance(error, (asyncio.TimeoutError, openai.APIConnectionError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+class Backend:
+    """One OpenAI-compatible endpoint and its routing state."""
+
+    def __init__(self, base_url: str, api_key: str):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.eject_seconds = EJECT_SECONDS
+        self.healthy = True
+
+    @property
+    def available(self) -> bool:
+        return self.healthy and time.monotonic() >= self.ejected_until
+
+    def record(self, error):
+        if error is not None and is_backend_failure(error):
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= EJECT_AFTER_FAILURES:
+                self.eject()
+        elif error is None:
+            self.consecutive_failures = 0
+            self.eject_seconds = EJECT_SECONDS
+
+    def eject(self):
+        self.ejected_until = time.monotonic() + self.eject_seconds
+        print(f"Ejecting backend {self.base_url} for {self.eject_seconds:.0f}s")
+        self.eject_seconds = min(MAX_EJECT_SECONDS, self.eject_seconds * 2)
+        self.consecutive_failures = 0
+
+    def stats(self) -> dict:
+        return {
+            "base_url": self.base_url,
+            "available": self.available,
+            "healthy": self.healthy,
+            "ejected_for_s": round(max(0.0, self.ejected_until - time.monotonic()), 1),
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+        }
+
+
+class BackendRoute:
+    # Holds one backend for one call; outcome is recorded when the call finishes
+
+    def __init__(self, pool, affinity):
+        self.pool = pool
+        self.affinity = affinity
+        self.backend = None
+
+    async def __aenter__(self) -> Backend:
+        self.backend = self.pool.pick(self.affinity)
+        self.backend.outstanding += 1
+        self.backend.requests += 1
+        return self.backend
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.backend.outstanding -= 1
+        if not isinstance(exc, asyncio.CancelledError):
+            self.backend.record(exc)
+        return False
+
+
+class BackendPool:
+    """Routes model calls over several OpenAI-compatible servers serving the same model.
+
+    Pass it wherever a base_url is expected (call_model resolves it per call). Calls go to
+    the available backend with the fewest outstanding requests, except that calls with
+    the same affinity key (the two calls of one page) stick to one backend while it is
+    available. Backends failing repeatedly, or failing the periodic health check, are
+    taken out of rotation.
+    """
+
+    def __init__(self, base_urls: List[str], api_key: str):
+        if not base_urls:
+            raise ValueError("BackendPool needs at least one base URL")
+        self.backends = [Backend(base_url, api_key) for base_url in base_urls]
+        self._affinity = OrderedDict()
+        self._health_task: Optional[asyncio.Task] = None
+
+    def route(self, affinity=None) -> BackendRoute:
+        return BackendRoute(self, affinity)
+
+    def pick(self, affinity=None) -> Backend:
+        backend = self._affinity.get(affinity) if affinity is not None else None
+        if backend is None or not backend.available:
+            available = [backend for backend in self.backends if backend.available]
+            if available:
+                backend = min(available, key=lambda backend: backend.outstanding)
+            else:
+                # Everything is down: try the backend due back first rather than failing outright
+                backend = min(self.backends, key=lambda backend: backend.ejected_until)
+        if affinity is not None:
+            self._affinity[affinity] = backend
+            self._affinity.move_to_end(affinity)
+            while len(self._affinity) > MAX_AFFINITY_KEYS:
+                self._affinity.popitem(last=False)
+        return backend
+
+    def start(self, interval: float = HEALTH_CHECK_INTERVAL):
+        if self._health_task is None:
+            self._health_task = asyncio.create_task(self._check_health(interval))
+
+    async def close(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+            self._health_task = None
+
+    async def _check_health(self, interval):
+        async with httpx.AsyncClient(timeout=HEALTH_CHECK_TIMEOUT) as client:
+            while True:
+                await asyncio.gather(*(self._check_backend(client, backend) for backend in self.backends))
+                await asyncio.sleep(interval)
+
+    async def _check_backend(self, client, backend):
+        try:
+            response = await client.get(
+                f"{backend.base_url.rstrip('/')}/models",
+                headers={"Authorization": f"Bearer {backend.api_key}"},
+            )
+            healthy = response.status_code == 200
+        except httpx.HTTPError:
+            healthy = False
+        if healthy != backend.healthy:
+            print(f"Backend {backend.base_url} is {'healthy' if healthy else 'unhealthy'}")
+        backend.healthy = healthy
+
+    def stats(self) -> List[dict]:
+        return [backend.stats() for backend in self.backends]
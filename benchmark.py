@@ -0,0 +1,297 @@
+import argparse
+import base64
+import json
+import os
+import resource
+import tempfile
+import time
+from io import BytesIO
+
+import httpx
+from dotenv import load_dotenv
+from PIL import Image
+
+from clients import run
+from usage import summarize_calls
+from utils import (
+    encode_image,
+    extract_pdf,
+    merge_data,
+    merge_soil_and_sample_data,
+    pdf_to_base64_images,
+    pdf_to_images,
+    process_images_in_batches,
+    DEFAULT_MAX_CONCURRENCY,
+    DEFAULT_EXTRACTION_MODE,
+    EXTRACTION_MODES,
+    ResolutionPolicy
+)
+
+# Resolution settings compared by the "resolution" benchmark; the first one is the reference
+RESOLUTION_PRESETS = {
+    "full-4000": ResolutionPolicy(fixed_length=4000),
+    "full-3000": ResolutionPolicy(fixed_length=3000),
+    "full-2000": ResolutionPolicy(fixed_length=2000),
+    "budget-4mp": ResolutionPolicy(fixed_length=4000, max_pixels=4_000_000),
+    "table-3000": ResolutionPolicy(fixed_length=3000, crop="table"),
+    "table-budget-4mp": ResolutionPolicy(fixed_length=3000, crop="table", max_pixels=4_000_000),
+    "tiles-3000": ResolutionPolicy(fixed_length=3000, tiling="header_table"),
+}
+
+# Qwen2.5-VL uses 14px patches merged 2x2, i.e. one visual token per 28x28 pixels
+VISUAL_TOKEN_PIXELS = 28
+# Pipeline stages of the on-disk path; they render the PDF a second time, so they are timed
+# next to the in-memory render for comparison but left out of staged_pages_per_s
+DISK_STAGES = ("pdf_to_images_s", "encode_image_s")
+
+
+# Fraction of reference fields (metadata and every soil/sample row) reproduced exactly by candidate
+def field_accuracy(reference_pages, candidate_pages, data_key):
+    total = 0
+    matched = 0
+    for reference, candidate in zip(reference_pages, candidate_pages):
+        for field, value in reference['metadata'].items():
+            total += 1
+            matched += candidate['metadata'].get(field) == value
+        candidate_rows = candidate[data_key]
+        for i, row in enumerate(reference[data_key]):
+            for field, value in row.items():
+                total += 1
+                if i < len(candidate_rows):
+                    matched += candidate_rows[i].get(field) == value
+    return matched / total if total else 1.0
+
+
+def render_pdf(pdf_path, fixed_length, policy=None):
+    return list(pdf_to_base64_images(pdf_path, fixed_length=fixed_length, policy=policy))
+
+
+def estimate_visual_tokens(images):
+    tokens = 0
+    pixels = 0
+    for page in images:
+        for image in page if isinstance(page, list) else [page]:
+            width, height = Image.open(BytesIO(base64.b64decode(image))).size
+            pixels += width * height
+            tokens += -(-width // VISUAL_TOKEN_PIXELS) * -(-height // VISUAL_TOKEN_PIXELS)
+    return tokens, pixels
+
+
+async def run_mode(images, base_url, api_key, mode, max_concurrency):
+    start = time.perf_counter()
+    page_errors = []
+    call_log = []
+    # The page cache is bypassed so every run measures real model calls
+    soil_data, sample_data = await process_images_in_batches(
+        images, base_url, api_key, max_concurrency=max_concurrency, extraction_mode=mode,
+        use_cache=False, page_errors=page_errors, call_log=call_log
+    )
+    elapsed = time.perf_counter() - start
+    usage = summarize_calls(call_log)
+    return soil_data, sample_data, {
+        "mode": mode,
+        "pages": len(images),
+        "requests": len(images) * len(EXTRACTION_MODES[mode]),
+        "wall_time_s": round(elapsed, 3),
+        "pages_per_s": round(len(images) / elapsed, 3) if elapsed else None,
+        "page_errors": len(page_errors),
+        # Reported by the server in completion.usage, unlike visual_tokens_est
+        "prompt_tokens": usage["prompt_tokens"],
+        "completion_tokens": usage["completion_tokens"],
+    }
+
+
+async def compare_extraction_modes(pdf_paths, base_url, api_key, fixed_length, max_concurrency):
+    results = []
+    for pdf_path in pdf_paths:
+        images = render_pdf(pdf_path, fixed_length)
+
+        # The two-call path is the reference the combined mode is scored against
+        reference_soil, reference_sample, two_call = await run_mode(
+            images, base_url, api_key, "two_call", max_concurrency
+        )
+        soil, sample, combined = await run_mode(
+            images, base_url, api_key, "combined", max_concurrency
+        )
+        combined["soil_field_accuracy"] = round(field_accuracy(reference_soil, soil, 'soil_data'), 4)
+        combined["sample_field_accuracy"] = round(field_accuracy(reference_sample, sample, 'sample_data'), 4)
+        combined["speedup"] = round(two_call["wall_time_s"] / combined["wall_time_s"], 3)
+        results.append({"pdf": os.path.basename(pdf_path), "two_call": two_call, "combined": combined})
+        print(json.dumps(results[-1], ensure_ascii=False))
+    return results
+
+
+async def compare_resolution_policies(pdf_paths, base_url, api_key, presets, max_concurrency, mode):
+    results = []
+    for pdf_path in pdf_paths:
+        reference = None
+        for name in presets:
+            policy = RESOLUTION_PRESETS[name]
+            start = time.perf_counter()
+            images = render_pdf(pdf_path, policy.fixed_length, policy)
+            render_time = time.perf_counter() - start
+            visual_tokens, pixels = estimate_visual_tokens(images)
+
+            soil, sample, stats = await run_mode(images, base_url, api_key, mode, max_concurrency)
+            stats.update({
+                "setting": name,
+                "policy": vars(policy),
+                "render_time_s": round(render_time, 3),
+                "pixels": pixels,
+                "visual_tokens_est": visual_tokens,
+                "visual_tokens_per_page": round(visual_tokens / len(images), 1) if images else 0,
+                "latency_per_page_s": round(stats["wall_time_s"] / len(images), 3) if images else 0,
+            })
+            # Field accuracy is measured against the first (highest resolution) setting
+            if reference is None:
+                reference = (soil, sample)
+            stats["soil_field_accuracy"] = round(field_accuracy(reference[0], soil, 'soil_data'), 4)
+            stats["sample_field_accuracy"] = round(field_accuracy(reference[1], sample, 'sample_data'), 4)
+            results.append({"pdf": os.path.basename(pdf_path), **stats})
+            print(json.dumps(results[-1], ensure_ascii=False))
+    return results
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux; children covers the render process pool
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return {"self": round(own / 1024, 1), "children": round(children / 1024, 1)}
+
+
+async def mock_stats(base_url, reset=False):
+    # Request counts kept by mock_server.py; None when benchmarking a real server
+    root = base_url.rstrip("/").rsplit("/v1", 1)[0]
+    try:
+        async with httpx.AsyncClient(timeout=5.0) as client:
+            response = await (client.post(f"{root}/mock/reset") if reset else client.get(f"{root}/mock/stats"))
+            response.raise_for_status()
+            return response.json()
+    except httpx.HTTPError:
+        return None
+
+
+async def benchmark_pipeline(pdf_paths, base_url, api_key, fixed_length, max_concurrency, mode):
+    """Per-stage wall time of the extraction pipeline for each PDF.
+
+    Stages: the on-disk path (pdf_to_images + encode_image) next to the in-memory render,
+    the model calls, merge_data and merge_soil_and_sample_data, then extract_pdf end to
+    end (classification, rendering and calls overlapped). The page cache is bypassed.
+    """
+    results = []
+    for pdf_path in pdf_paths:
+        stages = {}
+        await mock_stats(base_url, reset=True)
+
+        start = time.perf_counter()
+        with tempfile.TemporaryDirectory() as output_dir:
+            _, file_paths = pdf_to_images(pdf_path, output_dir, fixed_length=fixed_length)
+            stages["pdf_to_images_s"] = time.perf_counter() - start
+            start = time.perf_counter()
+            for file_path in file_paths:
+                encode_image(file_path)
+            stages["encode_image_s"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        images = render_pdf(pdf_path, fixed_length)
+        stages["pdf_to_base64_images_s"] = time.perf_counter() - start
+
+        soil_data, sample_data, calls = await run_mode(images, base_url, api_key, mode, max_concurrency)
+        stages["process_images_in_batches_s"] = calls["wall_time_s"]
+
+        start = time.perf_counter()
+        merged_soil, merged_sample = merge_data(soil_data, sample_data)
+        stages["merge_data_s"] = time.perf_counter() - start
+        start = time.perf_counter()
+        merge_soil_and_sample_data(merged_soil, merged_sample)
+        stages["merge_soil_and_sample_data_s"] = time.perf_counter() - start
+        staged_requests = await mock_stats(base_url)
+        staged_s = sum(value for name, value in stages.items() if name not in DISK_STAGES)
+
+        await mock_stats(base_url, reset=True)
+        page_errors = []
+        start = time.perf_counter()
+        await extract_pdf(
+            pdf_path, base_url, api_key, policy=ResolutionPolicy(fixed_length=fixed_length),
+            max_concurrency=max_concurrency, extraction_mode=mode, use_cache=False, page_errors=page_errors
+        )
+        end_to_end = time.perf_counter() - start
+        end_to_end_requests = await mock_stats(base_url)
+
+        results.append({
+            "pdf": os.path.basename(pdf_path),
+            "mode": mode,
+            "pages": len(images),
+            "stages_s": {name: round(value, 4) for name, value in stages.items()},
+            "staged_pages_per_s": round(len(images) / staged_s, 3) if staged_s else None,
+            "extract_pdf_s": round(end_to_end, 3),
+            "extract_pdf_pages_per_s": round(len(images) / end_to_end, 3) if end_to_end else None,
+            "page_errors": calls["page_errors"] + len(page_errors),
+            "requests": {
+                "staged": staged_requests["by_schema"] if staged_requests else calls["requests"],
+                "extract_pdf": end_to_end_requests["by_schema"] if end_to_end_requests else None,
+            },
+            "peak_rss_mb": peak_rss_mb(),
+        })
+        print(json.dumps(results[-1], ensure_ascii=False))
+    return results
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Benchmark extraction modes and page resolution settings")
+    parser.add_argument("benchmark", choices=["modes", "resolution", "pipeline"],
+                        help="modes: two-call vs combined; resolution: RESOLUTION_PRESETS; "
+                             "pipeline: per-stage timings")
+    parser.add_argument("pdfs", nargs="+", help="PDF reports to benchmark")
+    parser.add_argument("--base-url", default=os.getenv("BASE_URL", ""))
+    parser.add_argument("--api-key", default=os.getenv("API_KEY", ""))
+    parser.add_argument("--fixed-length", type=int, default=3000)
+    parser.add_argument("--max-concurrency", type=int, default=DEFAULT_MAX_CONCURRENCY)
+    parser.add_argument("--mode", default=DEFAULT_EXTRACTION_MODE, choices=list(EXTRACTION_MODES),
+                        help="Extraction mode used by the resolution and pipeline benchmarks")
+    parser.add_argument("--presets", nargs="+", default=list(RESOLUTION_PRESETS),
+                        choices=list(RESOLUTION_PRESETS), help="Resolution settings to compare")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    parser.add_argument("--mock", action="store_true",
+                        help="Run against mock_server.py started in this process instead of --base-url")
+    parser.add_argument("--mock-port", type=int, default=8765)
+    parser.add_argument("--mock-max-num-seqs", type=int, default=16)
+    parser.add_argument("--mock-prefill-s", type=float, default=0.5)
+    parser.add_argument("--mock-decode-tokens-per-s", type=float, default=400.0)
+    args = parser.parse_args()
+
+    if args.mock:
+        # Imported here so the other benchmarks don't need fastapi/uvicorn
+        from mock_server import BackgroundServer, MockSettings
+        settings = MockSettings(
+            max_num_seqs=args.mock_max_num_seqs, prefill_s=args.mock_prefill_s,
+            decode_tokens_per_s=args.mock_decode_tokens_per_s
+        )
+        with BackgroundServer(settings, port=args.mock_port) as server:
+            args.base_url = server.base_url
+            args.api_key = args.api_key or "mock"
+            results = run_benchmark(args)
+    else:
+        results = run_benchmark(args)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+def run_benchmark(args):
+    if args.benchmark == "pipeline":
+        return run(benchmark_pipeline(
+            args.pdfs, args.base_url, args.api_key, args.fixed_length, args.max_concurrency, args.mode
+        ))
+    if args.benchmark == "modes":
+        return run(compare_extraction_modes(
+            args.pdfs, args.base_url, args.api_key, args.fixed_length, args.max_concurrency
+        ))
+    return run(compare_resolution_policies(
+        args.pdfs, args.base_url, args.api_key, args.presets, args.max_concurrency, args.mode
+    ))
+
+
+if __name__ == "__main__":
+    main()
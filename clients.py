@@ -0,0 +1,97 @@
+import asyncio
+import time
+
+import httpx
+import openai
+
+# Connection pool sized for a full in-flight window plus some headroom
+MAX_CONNECTIONS = 64
+MAX_KEEPALIVE_CONNECTIONS = 32
+REQUEST_TIMEOUT = httpx.Timeout(600.0, connect=10.0)
+
+# How long a resolved model id is trusted before models.list() is called again
+MODEL_ID_TTL = 300.0
+
+
+class ClientManager:
+    """Holds one long-lived AsyncOpenAI client per (base_url, api_key) and caches model discovery."""
+
+    def __init__(self, model_id_ttl: float = MODEL_ID_TTL):
+        self.model_id_ttl = model_id_ttl
+        self._clients = {}
+        self._model_ids = {}
+        self._model_locks = {}
+
+    def get_client(self, base_url: str, api_key: str) -> openai.AsyncClient:
+        # httpx pools are bound to the event loop that created them, and the Streamlit apps
+        # call asyncio.run() per upload, so clients are kept per running loop as well
+        loop = asyncio.get_running_loop()
+        self._drop_closed_loops()
+        key = (loop, base_url, api_key)
+        client = self._clients.get(key)
+        if client is None:
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=MAX_CONNECTIONS,
+                    max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                ),
+                timeout=REQUEST_TIMEOUT,
+            )
+            # Retries are done by utils.call_model, which also frees the call slot while waiting
+            client = openai.AsyncClient(base_url=base_url, api_key=api_key, http_client=http_client, max_retries=0)
+            self._clients[key] = client
+        return client
+
+    async def get_model_id(self, base_url: str, api_key: str) -> str:
+        key = (base_url, api_key)
+        cached = self._model_ids.get(key)
+        if cached and time.monotonic() - cached[1] < self.model_id_ttl:
+            return cached[0]
+
+        # Only one coroutine per loop refreshes the id; the rest wait and reuse it
+        loop = asyncio.get_running_loop()
+        lock = self._model_locks.setdefault((loop, base_url, api_key), asyncio.Lock())
+        async with lock:
+            cached = self._model_ids.get(key)
+            if cached and time.monotonic() - cached[1] < self.model_id_ttl:
+                return cached[0]
+            client = self.get_client(base_url, api_key)
+            model_list = await client.models.list()
+            model = model_list.data[0].id
+            self._model_ids[key] = (model, time.monotonic())
+            return model
+
+    def invalidate_model_id(self, base_url: str, api_key: str):
+        self._model_ids.pop((base_url, api_key), None)
+
+    async def aclose(self):
+        # Close the clients owned by the current loop (e.g. on FastAPI shutdown)
+        loop = asyncio.get_running_loop()
+        for key in [key for key in self._clients if key[0] is loop]:
+            await self._clients.pop(key).close()
+
+    def _drop_closed_loops(self):
+        # A closed loop can no longer close its connections; run() closes them before then
+        for key in [key for key in self._clients if key[0].is_closed()]:
+            print(f"Dropping a model client for {key[1]} whose event loop closed before aclose()")
+            del self._clients[key]
+        for key in [key for key in self._model_locks if key[0].is_closed()]:
+            del self._model_locks[key]
+
+
+# Process-wide manager shared by make_api_call, the Streamlit apps and the FastAPI service
+client_manager = ClientManager()
+
+
+def run(coroutine):
+    """asyncio.run() that closes the coroutine's model clients before its loop goes away.
+
+    For entry points that start a new event loop per job, like the Streamlit apps.
+    """
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            await client_manager.aclose()
+
+    return asyncio.run(main())
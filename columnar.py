@@ -0,0 +1,204 @@
+from dataclasses import dataclass
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from pydantic_models import Sample, Soil
+
+# Raw fields of every row, in the order of the pydantic models
+SOIL_FIELDS = list(Soil.model_fields)
+SAMPLE_FIELDS = list(Sample.model_fields)
+# Repetitive text columns stored as categoricals (one code per row instead of one string)
+CATEGORY_COLUMNS = ["hole_no", "soil_name", "soil_color", "Method"]
+# Standard SPT penetration in cm; N-values of partial drives are scaled up to it
+SPT_PENETRATION_CM = 30.0
+# Drives stop at refusal (50 blows in Korean practice, sometimes 60); counts above this are misreads
+MAX_SPT_BLOWS = 100
+# Columns parse_hits derives from Hits, added to every sample by utils.merge_data
+HITS_FIELDS = ["blow_count", "penetration_cm", "n_value", "hits_issue"]
+DEPTH_RANGE_PATTERN = r"^\s*(-?\d+(?:\.\d+)?)\s*m?\s*[~～]\s*(-?\d+(?:\.\d+)?)\s*m?\s*$"
+HITS_PATTERN = r"^\s*(\d+(?:\.\d+)?)\s*/\s*(\d+(?:\.\d+)?)\s*(?:cm)?\s*$"
+
+
+@dataclass
+class BoreholeFrames:
+    """Merged borehole data as DataFrames keyed by hole_no.
+
+    metadata has one row per hole (indexed by hole_no). soil has one row per layer with
+    its position in the hole (layer) and the parsed depth_min/depth_max; samples has one
+    row per sample with the parsed blow_count, penetration_cm, n_value and hits_issue (see
+    parse_hits). Unparsable values are NaN.
+    """
+    metadata: pd.DataFrame
+    soil: pd.DataFrame
+    samples: pd.DataFrame
+
+
+def parse_depth_ranges(depth_ranges: pd.Series) -> pd.DataFrame:
+    # Vectorised extract_depth_range: depth_min <= depth_max, NaN where unparsable
+    parts = depth_ranges.astype("string").str.extract(DEPTH_RANGE_PATTERN).astype("float64")
+    return pd.DataFrame({
+        "depth_min": np.fmin(parts[0], parts[1]),
+        "depth_max": np.fmax(parts[0], parts[1]),
+    }, index=depth_ranges.index)
+
+
+def parse_hits(hits: pd.Series) -> pd.DataFrame:
+    """Parse SPT "blows/penetration(cm)" strings such as "10/30" or "50/8".
+
+    n_value is the blow count scaled to SPT_PENETRATION_CM. hits_issue names what is wrong
+    with an unparsable or impossible value (n_value is then NaN) and is None otherwise.
+    A refusal drive like "50/8" scales past MAX_SPT_BLOWS; its n_value is capped there
+    and flagged as well.
+    """
+    parts = hits.astype("string").str.extract(HITS_PATTERN).astype("float64")
+    blow_count, penetration = parts[0], parts[1]
+    n_value = blow_count * SPT_PENETRATION_CM / penetration
+    invalid = [
+        blow_count.isna(),
+        penetration <= 0,
+        penetration > SPT_PENETRATION_CM,
+        blow_count > MAX_SPT_BLOWS,
+    ]
+    issues = ["unparsable", "zero penetration", f"penetration over {SPT_PENETRATION_CM:g} cm",
+              f"more than {MAX_SPT_BLOWS} blows"]
+    capped = n_value > MAX_SPT_BLOWS
+    # default=None keeps the column object-typed with real None for valid values
+    hits_issue = pd.Series(
+        np.select(invalid + [capped], issues + [f"N-value capped at {MAX_SPT_BLOWS}"], default=None),
+        index=hits.index, dtype="object",
+    )
+    valid = ~np.logical_or.reduce(invalid)
+    return pd.DataFrame({
+        "blow_count": blow_count,
+        "penetration_cm": penetration,
+        "n_value": n_value.clip(upper=MAX_SPT_BLOWS).where(valid),
+        "hits_issue": hits_issue,
+    }, index=hits.index)
+
+
+def annotate_hits(samples: List[dict]) -> List[dict]:
+    # Add the HITS_FIELDS to sample dicts in place, parsing all of them in one vectorised pass
+    if not samples:
+        return samples
+    parsed = parse_hits(pd.Series([sample.get('Hits') for sample in samples], dtype="object"))
+    for sample, row in zip(samples, parsed.itertuples(index=False)):
+        sample.update({field: _value(value) for field, value in zip(HITS_FIELDS, row)})
+    return samples
+
+
+def _categorize(frame):
+    for column in CATEGORY_COLUMNS:
+        if column in frame:
+            frame[column] = frame[column].astype("category")
+    return frame
+
+
+def to_frames(soil_data: List[dict], sample_data: List[dict]) -> BoreholeFrames:
+    """Columnar copy of merge_data's output (or of per-page results)."""
+    metadata = {}
+    soil_rows = []
+    layer_numbers = []
+    # Layers are numbered per hole across entries, so per-page results keep their order
+    layer_counts = {}
+    for entry in soil_data:
+        hole_no = entry['metadata']['HOLE_NO']
+        metadata.setdefault(hole_no, entry['metadata'])
+        for soil in entry['soil_data']:
+            soil_rows.append({"hole_no": hole_no, **{field: soil.get(field) for field in SOIL_FIELDS}})
+            layer_numbers.append(layer_counts.get(hole_no, 0))
+            layer_counts[hole_no] = layer_numbers[-1] + 1
+    sample_rows = []
+    for entry in sample_data:
+        hole_no = entry['metadata']['HOLE_NO']
+        metadata.setdefault(hole_no, entry['metadata'])
+        for sample in entry['sample_data']:
+            sample_rows.append({"hole_no": hole_no, **{field: sample.get(field) for field in SAMPLE_FIELDS}})
+
+    soil = pd.DataFrame(soil_rows, columns=["hole_no"] + SOIL_FIELDS)
+    soil.insert(1, "layer", np.asarray(layer_numbers, dtype="int32"))
+    soil = pd.concat([soil, parse_depth_ranges(soil["depth_range"])], axis=1)
+
+    samples = pd.DataFrame(sample_rows, columns=["hole_no"] + SAMPLE_FIELDS)
+    samples["Depth"] = pd.to_numeric(samples["Depth"], errors="coerce").astype("float64")
+    samples = pd.concat([samples, parse_hits(samples["Hits"])], axis=1)
+
+    # Only the metadata fields that were extracted; holes missing one of them get NaN
+    metadata_frame = pd.DataFrame.from_dict(metadata, orient="index")
+    metadata_frame.index.name = "hole_no"
+    return BoreholeFrames(metadata_frame, _categorize(soil), _categorize(samples))
+
+
+def _value(value):
+    # Back to plain JSON values: NaN becomes None, numpy scalars become Python ones
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def from_frames(frames: BoreholeFrames) -> Tuple[List[dict], List[dict]]:
+    """merge_data-shaped (soil_data, sample_data) lists from BoreholeFrames, one entry per hole.
+
+    Samples include the parsed HITS_FIELDS, as in merge_data's output.
+    """
+    metadata = {
+        hole_no: {field: _value(value) for field, value in row.items()}
+        for hole_no, row in frames.metadata.iterrows()
+    }
+    soil_data = []
+    for hole_no, layers in frames.soil.groupby("hole_no", sort=False, observed=True):
+        soil_data.append({
+            'metadata': metadata.get(hole_no, {"HOLE_NO": hole_no}),
+            'soil_data': [
+                {field: _value(value) for field, value in zip(SOIL_FIELDS, row)}
+                for row in layers.sort_values("layer", kind="stable")[SOIL_FIELDS].itertuples(index=False)
+            ],
+        })
+    sample_data = []
+    for hole_no, samples in frames.samples.groupby("hole_no", sort=False, observed=True):
+        sample_data.append({
+            'metadata': metadata.get(hole_no, {"HOLE_NO": hole_no}),
+            'sample_data': [
+                {field: _value(value) for field, value in zip(SAMPLE_FIELDS + HITS_FIELDS, row)}
+                for row in samples[SAMPLE_FIELDS + HITS_FIELDS].itertuples(index=False)
+            ],
+        })
+    return soil_data, sample_data
+
+
+def join_samples(frames: BoreholeFrames, closed: str = "both") -> pd.DataFrame:
+    """One row per (soil layer, sample) pair whose Depth lies in the layer's depth range.
+
+    The vectorised counterpart of utils.merge_soil_and_sample_data, with the same closed
+    boundary conventions. Samples are located with np.searchsorted per hole.
+    """
+    if closed not in ("both", "left", "right"):
+        raise ValueError(f"Unknown boundary convention: {closed}")
+    samples = frames.samples[frames.samples["Depth"].notna()].sort_values("Depth", kind="stable")
+    samples_by_hole = dict(tuple(samples.groupby("hole_no", sort=False, observed=True)))
+    soil = frames.soil[frames.soil["depth_min"].notna()]
+    pairs = []
+    for hole_no, layers in soil.groupby("hole_no", sort=False, observed=True):
+        hole_samples = samples_by_hole.get(hole_no)
+        if hole_samples is None:
+            continue
+        depths = hole_samples["Depth"].to_numpy()
+        starts = np.searchsorted(
+            depths, layers["depth_min"].to_numpy(), "left" if closed in ("both", "left") else "right"
+        )
+        ends = np.searchsorted(
+            depths, layers["depth_max"].to_numpy(), "right" if closed in ("both", "right") else "left"
+        )
+        counts = np.maximum(ends - starts, 0)
+        # Expand every layer into its run of matching sample positions
+        layer_positions = np.repeat(np.arange(len(layers)), counts)
+        sample_positions = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        pairs.append(pd.concat([
+            layers.iloc[layer_positions].reset_index(drop=True),
+            hole_samples.iloc[sample_positions].drop(columns="hole_no").reset_index(drop=True),
+        ], axis=1))
+    if not pairs:
+        sample_columns = [column for column in frames.samples.columns if column != "hole_no"]
+        return pd.DataFrame(columns=list(frames.soil.columns) + sample_columns)
+    return pd.concat(pairs, ignore_index=True)
@@ -0,0 +1,141 @@
+import asyncio
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+# Finished jobs are kept this long (seconds) so clients can still poll and fetch results
+DEFAULT_JOB_TTL = 3600
+
+
+class Job:
+    """State of one submitted drill-log request: per-PDF progress and boreholes found so far."""
+
+    def __init__(self, request):
+        self.job_id = uuid.uuid4().hex
+        self.request = request
+        self.status = "queued"
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.pdfs: Dict[str, Dict[str, Any]] = {
+            s3_url: {"status": "queued", "pages_total": None, "pages_done": 0, "error": None}
+            for s3_url in dict.fromkeys(request.s3_urls)
+        }
+        self.boreholes: List[Dict[str, Any]] = []
+        # (source_pdf_url, hole_no) -> position in boreholes
+        self._borehole_positions: Dict[Tuple[str, str], int] = {}
+        self.map_boreholes: List[Dict[str, Any]] = []
+        # ("borehole" | "borehole_updated" | "map_borehole", data) in the order they were
+        # found, for stream_events
+        self.events: List[Tuple[str, Dict[str, Any]]] = []
+        self.processing_summary: Optional[Dict[str, Any]] = None
+        self._changed = asyncio.Condition()
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("completed", "failed")
+
+    async def add_boreholes(self, boreholes: List[Dict[str, Any]]):
+        # A borehole published again, with pages found after its first run ended, replaces
+        # the earlier entry and is sent as "borehole_updated"
+        async with self._changed:
+            for borehole in boreholes:
+                key = (borehole["source_pdf_url"], borehole["hole_no"])
+                if key in self._borehole_positions:
+                    self.boreholes[self._borehole_positions[key]] = borehole
+                    self.events.append(("borehole_updated", borehole))
+                else:
+                    self._borehole_positions[key] = len(self.boreholes)
+                    self.boreholes.append(borehole)
+                    self.events.append(("borehole", borehole))
+            self._changed.notify_all()
+
+    async def add_map_boreholes(self, map_boreholes: List[Dict[str, Any]]):
+        async with self._changed:
+            self.map_boreholes.extend(map_boreholes)
+            self.events.extend(("map_borehole", borehole) for borehole in map_boreholes)
+            self._changed.notify_all()
+
+    async def set_status(self, status: str, processing_summary: Optional[Dict[str, Any]] = None):
+        async with self._changed:
+            self.status = status
+            if processing_summary is not None:
+                self.processing_summary = processing_summary
+            if self.done:
+                self.finished_at = time.time()
+            self._changed.notify_all()
+
+    async def stream_events(self):
+        # Yield (event, data) for boreholes as they are found, then return once the job is done
+        sent = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: len(self.events) > sent or self.done)
+                pending = self.events[sent:]
+                finished = self.done
+            for event in pending:
+                yield event
+            sent += len(pending)
+            if finished and sent == len(self.events):
+                return
+
+    def to_status(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "pdf_id": self.request.pdf_id,
+            "user_id": self.request.user_id,
+            "status": self.status,
+            "pdfs": [{"s3_url": s3_url, **progress} for s3_url, progress in self.pdfs.items()],
+            "boreholes_found": len(self.boreholes),
+            "map_boreholes_found": len(self.map_boreholes),
+            "processing_summary": self.processing_summary,
+        }
+
+
+class JobStore:
+    """In-process job store with a fixed pool of worker tasks draining a job queue."""
+
+    def __init__(self, max_workers: int = 2, ttl: float = DEFAULT_JOB_TTL):
+        self.max_workers = max_workers
+        self.ttl = ttl
+        self.jobs: Dict[str, Job] = {}
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._workers: List[asyncio.Task] = []
+
+    def start(self, runner):
+        # runner(job) does the actual processing; it is awaited by one worker per job
+        for _ in range(self.max_workers):
+            self._workers.append(asyncio.create_task(self._work(runner)))
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+
+    def submit(self, request) -> Job:
+        self._evict_expired()
+        job = Job(request)
+        self.jobs[job.job_id] = job
+        self._queue.put_nowait(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self._evict_expired()
+        return self.jobs.get(job_id)
+
+    async def _work(self, runner):
+        while True:
+            job = await self._queue.get()
+            try:
+                await job.set_status("running")
+                await runner(job)
+            except Exception as e:
+                await job.set_status("failed", {"errors": [str(e)]})
+            finally:
+                self._queue.task_done()
+
+    def _evict_expired(self):
+        now = time.time()
+        for job_id in [job_id for job_id, job in self.jobs.items()
+                       if job.finished_at and now - job.finished_at > self.ttl]:
+            del self.jobs[job_id]
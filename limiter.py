@@ -0,0 +1,173 @@
+import asyncio
+import time
+from typing import List, Optional
+
+import httpx
+import openai
+
+from vllm_metrics import fetch_combined_metrics, REQUESTS_WAITING
+
+# Bounds and starting point of the in-flight window; 16 matches --max-num-seqs in ngrok.py
+DEFAULT_INITIAL_LIMIT = 16
+DEFAULT_MIN_LIMIT = 1
+DEFAULT_MAX_LIMIT = 64
+# The window shrinks once smoothed latency exceeds the best smoothed latency seen by this factor
+LATENCY_TOLERANCE = 2.0
+# Multiplicative decrease on rising latency / server queueing, and on 429/503/timeouts
+LATENCY_BACKOFF = 0.9
+OVERLOAD_BACKOFF = 0.5
+# Weight of the newest sample in the latency average, and the time (seconds) over which the
+# baseline follows the average upwards, so a slower model or bigger pages don't pin the
+# window at its minimum forever
+LATENCY_SMOOTHING = 0.2
+BASELINE_WINDOW = 300.0
+# How often vLLM's /metrics is polled when a metrics URL is given
+METRICS_POLL_INTERVAL = 2.0
+
+
+def is_overload(error) -> bool:
+    # Responses that mean the server is saturated, as opposed to a bad request
+    if isinstance(error, (asyncio.TimeoutError, openai.RateLimitError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code == 503
+
+
+class LimiterSlot:
+    # One call's hold on the limiter; latency is tracked per key (e.g. the response schema)
+    # because a thumbnail classification and a full-page extraction take very different times.
+    # A call answered without the server (e.g. from the page cache) sets cached, so its
+    # near-zero latency doesn't drag the baseline down
+
+    def __init__(self, limiter, key):
+        self.limiter = limiter
+        self.key = key
+        self.start = None
+        self.cached = False
+
+    async def __aenter__(self):
+        await self.limiter._acquire()
+        self.start = time.monotonic()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.limiter._release(self.key, None if self.cached else time.monotonic() - self.start, exc)
+        return False
+
+
+class AdaptiveLimiter:
+    """AIMD cap on in-flight model calls, usable like an asyncio.Semaphore (async with).
+
+    Every call that finishes below the latency target grows the window by about one call
+    per window of completions; rising latency, 429/503/timeouts and (optionally) requests
+    queued inside vLLM shrink it multiplicatively, at most once per smoothed call latency.
+    Use slot(key) to track latency separately for different kinds of calls.
+    """
+
+    def __init__(self, initial_limit: int = DEFAULT_INITIAL_LIMIT, min_limit: int = DEFAULT_MIN_LIMIT,
+                 max_limit: int = DEFAULT_MAX_LIMIT, latency_tolerance: float = LATENCY_TOLERANCE):
+        self.min_limit = min_limit
+        self.max_limit = max(max_limit, min_limit)
+        self.limit = float(min(max(initial_limit, min_limit), self.max_limit))
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        # key -> [smoothed latency, baseline latency, time of last update]
+        self.latencies = {}
+        self.server_waiting: Optional[float] = None
+        self.increases = 0
+        self.decreases = 0
+        self._last_decrease = 0.0
+        self._task_slots = {}
+        self._changed = asyncio.Condition()
+        self._metrics_task: Optional[asyncio.Task] = None
+
+    def slot(self, key=None) -> LimiterSlot:
+        return LimiterSlot(self, key)
+
+    async def __aenter__(self):
+        # Plain "async with limiter:" use needs a slot per task to time the call
+        slot = self.slot()
+        await slot.__aenter__()
+        self._task_slots[asyncio.current_task()] = slot
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return await self._task_slots.pop(asyncio.current_task()).__aexit__(exc_type, exc, tb)
+
+    async def _acquire(self):
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def _release(self, key, elapsed, error):
+        async with self._changed:
+            self.in_flight -= 1
+            if error is None:
+                if elapsed is not None:
+                    self._on_success(key, elapsed)
+            elif is_overload(error):
+                known = self.latencies.get(key) or max(self.latencies.values(), default=[0.0])
+                self._decrease(OVERLOAD_BACKOFF, known[0])
+            self._changed.notify_all()
+
+    def _on_success(self, key, elapsed):
+        now = time.monotonic()
+        latency = self.latencies.get(key)
+        if latency is None:
+            latency = self.latencies[key] = [elapsed, elapsed, now]
+        else:
+            drift = min(1.0, (now - latency[2]) / BASELINE_WINDOW)
+            latency[0] += LATENCY_SMOOTHING * (elapsed - latency[0])
+            latency[1] = min(latency[0], latency[1] + drift * (latency[0] - latency[1]))
+            latency[2] = now
+        if latency[0] > latency[1] * self.latency_tolerance or (self.server_waiting or 0) > 0:
+            self._decrease(LATENCY_BACKOFF, latency[0])
+        elif self.in_flight + 1 >= int(self.limit) and self.limit < self.max_limit:
+            # Only grow while the window is actually full, otherwise it drifts up unused
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.increases += 1
+
+    def _decrease(self, factor, latency):
+        # One decrease per smoothed latency: calls already in flight saw the same congestion
+        now = time.monotonic()
+        if now - self._last_decrease < latency:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * factor)
+        self.decreases += 1
+
+    def watch_metrics(self, metrics_urls: List[str], interval: float = METRICS_POLL_INTERVAL):
+        """Poll vLLM's Prometheus endpoints for queued requests until close() is awaited."""
+        if self._metrics_task is None:
+            self._metrics_task = asyncio.create_task(self._poll_metrics(metrics_urls, interval))
+
+    async def _poll_metrics(self, metrics_urls, interval):
+        async with httpx.AsyncClient(timeout=interval) as client:
+            while True:
+                try:
+                    metrics = await fetch_combined_metrics(metrics_urls, client)
+                    self.server_waiting = metrics.get(REQUESTS_WAITING)
+                except httpx.HTTPError as e:
+                    # Metrics are optional; latency and error feedback keep working without them
+                    print(f"Could not read vLLM metrics from {metrics_urls}: {e}")
+                    self.server_waiting = None
+                await asyncio.sleep(interval)
+
+    async def close(self):
+        if self._metrics_task is not None:
+            self._metrics_task.cancel()
+            await asyncio.gather(self._metrics_task, return_exceptions=True)
+            self._metrics_task = None
+
+    def stats(self) -> dict:
+        return {
+            "limit": int(self.limit),
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "in_flight": self.in_flight,
+            "latency_s": {
+                str(key): {"smoothed": round(latency[0], 3), "baseline": round(latency[1], 3)}
+                for key, latency in self.latencies.items()
+            },
+            "server_waiting": self.server_waiting,
+            "increases": self.increases,
+            "decreases": self.decreases,
+        }
@@ -1,14 +1,13 @@
 import streamlit as st
 import os
 import base64
-import asyncio
 import json
 import nest_asyncio
 from dotenv import load_dotenv
 
 from utils import (
-    pdf_to_images,
-    encode_image,
+    resolution_policy_from_env,
+    pdf_to_base64_images,
     process_images_in_batches,
     merge_data,
     merge_soil_and_sample_data
@@ -16,11 +15,13 @@ from utils import (
 
 from pydantic_models import MetadataAndSoilData, MetadataAndSampleData
 from prompts import prompt_soil_data, prompt_sample_data
+from clients import run
 
 # Load environment variables
 load_dotenv()
 base_url = os.getenv("BASE_URL", "")
 api_key = os.getenv("API_KEY", "")
+extraction_mode = os.getenv("EXTRACTION_MODE", "two_call")
 
 nest_asyncio.apply()
 
@@ -46,23 +47,21 @@ def handle_pdf_upload():
             # Process only once
             output_dir = create_directories(pdf_path)
             st.info("🔄 Converting PDF to images...")
-            pdf_to_images(pdf_path, output_dir, fixed_length=3000, max_workers=4)
+            # Rendered in memory at 3000px unless RENDER_* overrides are set; pages are also kept in output_dir
+            image_base64_list = list(pdf_to_base64_images(
+                pdf_path, debug_dir=output_dir, base_name=os.path.basename(output_dir), max_workers=4,
+                policy=resolution_policy_from_env(3000)
+            ))
 
-            image_files = sorted([
-                os.path.join(output_dir, f) 
-                for f in os.listdir(output_dir) 
-                if f.lower().endswith((".png", ".jpg", ".jpeg"))
-            ])
-            
-            if not image_files:
-                st.error("❌ No image files found after PDF conversion.")
+            if not image_base64_list:
+                st.error("❌ No pages found in the PDF.")
                 return
-            
-            image_base64_list = [encode_image(image_path) for image_path in image_files]
 
             st.info("⚙️ Processing images through the model...")
             try:
-                soil_data, sample_data = asyncio.run(process_images_in_batches(image_base64_list, base_url, api_key))
+                soil_data, sample_data = run(process_images_in_batches(
+                    image_base64_list, base_url, api_key, extraction_mode=extraction_mode
+                ))
             except Exception as e:
                 st.error(f"❌ Error during batch processing: {e}")
                 return
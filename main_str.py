@@ -1,22 +1,21 @@
 import streamlit as st
-import os
 import base64
-import asyncio
 import json
-import tempfile
 import shutil
 from pathlib import Path
 
 from utils import (
-    pdf_to_images,
-    encode_image,
-    process_images_in_batches,
+    resolution_policy_from_env,
+    extract_pdf,
     merge_data,
     merge_soil_and_sample_data
 )
 
 from pydantic_models import MetadataAndSoilData, MetadataAndSampleData
 from prompts import prompt_soil_data, prompt_sample_data
+from usage import summarize_calls
+from merger import IncrementalMerger
+from clients import run
 
 # Configure Streamlit page
 st.set_page_config(
@@ -36,53 +35,38 @@ def get_config():
         st.error(f"❌ Missing secret: {e}. Please configure secrets in Streamlit Cloud.")
         st.stop()
 
-@st.cache_data
-def process_pdf_to_images(pdf_bytes, filename):
-    """Process PDF to images with caching and temporary directories"""
-    with tempfile.TemporaryDirectory() as temp_dir:
-        # Save uploaded PDF to temporary file
-        pdf_path = os.path.join(temp_dir, filename)
-        with open(pdf_path, "wb") as f:
-            f.write(pdf_bytes)
-        
-        # Create output directory for images
-        output_dir = os.path.join(temp_dir, "images")
-        os.makedirs(output_dir, exist_ok=True)
-        
-        # Convert PDF to images (reduced workers for cloud)
-        pdf_to_images(pdf_path, output_dir, fixed_length=3000, max_workers=2)
-        
-        # Get all image files
-        image_files = sorted([
-            os.path.join(output_dir, f) 
-            for f in os.listdir(output_dir) 
-            if f.lower().endswith((".png", ".jpg", ".jpeg"))
-        ])
+async def process_images_async(pdf_bytes, base_url, api_key):
+    """Async wrapper for page classification and image processing"""
+    try:
+        # Reduced resolution for cloud unless RENDER_* overrides are set
+        page_errors = []
+        call_log = []
+        merger = IncrementalMerger()
         
-        if not image_files:
-            return None
+        def announce(boreholes):
+            for borehole in boreholes:
+                layers = len(borehole['soil_data'])
+                st.info(f"🕳️ HOLE {borehole['metadata']['HOLE_NO']} extracted ({layers} soil layers)")
         
-        # Encode images to base64
-        image_base64_list = []
-        for image_path in image_files:
-            try:
-                encoded_image = encode_image(image_path)
-                image_base64_list.append(encoded_image)
-            except Exception as e:
-                st.warning(f"⚠️ Failed to encode image {os.path.basename(image_path)}: {e}")
-                continue
+        def on_page_result(page_index, kind, result):
+            # Announce each borehole as soon as its last page is in
+            announce(merger.add(page_index, kind, result))
         
-        return image_base64_list
-
-async def process_images_async(image_base64_list, base_url, api_key):
-    """Async wrapper for image processing"""
-    try:
-        return await process_images_in_batches(image_base64_list, base_url, api_key)
+        soil_data, sample_data, map_data, _ = await extract_pdf(
+            pdf_bytes, base_url, api_key, policy=resolution_policy_from_env(3000), page_errors=page_errors,
+            call_log=call_log, on_page_result=on_page_result
+        )
+        # The last borehole of the document is only complete once every page is in
+        announce(merger.finish())
+        for record in page_errors:
+            st.warning(f"⚠️ Page {record['page_number']} ({record['kind']}) could not be extracted: {record['error']}")
+        map_boreholes = [borehole for page in map_data for borehole in page['metadata']]
+        return soil_data, sample_data, map_boreholes, summarize_calls(call_log)
     except Exception as e:
         st.error(f"❌ Error during batch processing: {e}")
-        return None, None
+        return None, None, None, None
 
-def display_hole_data(final_data):
+def display_hole_data(final_data, usage=None):
     """Display hole data with improved UI"""
     if not final_data:
         st.warning("⚠️ No data available to display.")
@@ -126,6 +110,8 @@ def display_hole_data(final_data):
             
             with tab1:
                 display_summary_view(selected_data)
+                if usage:
+                    display_usage_view(usage)
             
             with tab2:
                 display_detailed_view(selected_data)
@@ -135,6 +121,11 @@ def display_hole_data(final_data):
         else:
             st.error(f"❌ No data found for HOLE_NO: {selected_hole}")
 
+def display_map_boreholes(map_boreholes):
+    """Display the boreholes listed on boring location map pages"""
+    st.subheader("🗺️ Boreholes on Location Maps")
+    st.dataframe(map_boreholes, use_container_width=True)
+
 def display_summary_view(data):
     """Display a summary view of the data"""
     st.write(f"**Total Records:** {len(data)}")
@@ -149,6 +140,25 @@ def display_summary_view(data):
     with col2:
         st.metric("🧪 Sample Data Records", sample_count)
 
+def display_usage_view(usage):
+    """Display model token usage and latency for the whole PDF"""
+    st.subheader("📈 Model Usage (whole PDF)")
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Model Calls", usage["calls"], help=f"{usage['cached_calls']} answered from the page cache")
+    with col2:
+        st.metric("Prompt Tokens", usage["prompt_tokens"])
+    with col3:
+        st.metric("Completion Tokens", usage["completion_tokens"])
+    with col4:
+        st.metric("Tokens per Page", usage.get("tokens_per_page", 0))
+    
+    st.write("**By prompt:**")
+    st.dataframe([{"prompt": schema, **totals} for schema, totals in usage["by_prompt"].items()])
+    if usage.get("top_pages"):
+        st.write("**Most expensive pages:**")
+        st.dataframe(usage["top_pages"])
+
 def display_detailed_view(data):
     """Display detailed view with expandable sections"""
     for i, item in enumerate(data):
@@ -209,29 +219,13 @@ def handle_pdf_upload():
             with st.spinner("🔄 Processing PDF..."):
                 progress_bar = st.progress(0)
                 
-                # Step 1: Convert PDF to images
-                st.info("📷 Converting PDF to images...")
+                # Step 1: Render pages and stream each one through the model as soon as it is ready
+                st.info("⚙️ Rendering pages and processing them through AI model...")
                 progress_bar.progress(20)
                 
-                image_base64_list = process_pdf_to_images(
-                    uploaded_pdf.getvalue(), 
-                    uploaded_pdf.name
-                )
-                
-                if not image_base64_list:
-                    st.error("❌ No images could be extracted from the PDF.")
-                    return
-                
-                progress_bar.progress(40)
-                st.success(f"✅ Extracted {len(image_base64_list)} images from PDF")
-                
-                # Step 2: Process images through model
-                st.info("⚙️ Processing images through AI model...")
-                progress_bar.progress(60)
-                
                 try:
-                    soil_data, sample_data = asyncio.run(
-                        process_images_async(image_base64_list, base_url, api_key)
+                    soil_data, sample_data, map_boreholes, usage = run(
+                        process_images_async(uploaded_pdf.getvalue(), base_url, api_key)
                     )
                     
                     if soil_data is None or sample_data is None:
@@ -242,31 +236,47 @@ def handle_pdf_upload():
                     st.error(f"❌ Error during AI processing: {e}")
                     return
                 
-                progress_bar.progress(80)
+                if not soil_data and not map_boreholes:
+                    st.error("❌ No drill-log pages could be extracted from the PDF.")
+                    return
                 
-                # Step 3: Merge data
-                st.info("🧩 Merging and structuring data...")
+                st.session_state[f"map_boreholes_{cache_key}"] = map_boreholes
+                st.session_state[f"usage_{cache_key}"] = usage
+                if not soil_data:
+                    # Only location maps; there are no drill-log tables to merge
+                    st.warning("⚠️ No drill-log pages could be extracted; showing the location map boreholes.")
+                    st.session_state[f"final_data_{cache_key}"] = []
+                    progress_bar.progress(100)
+                else:
+                    st.success(f"✅ Extracted data from {len(soil_data)} pages")
+                    progress_bar.progress(80)
                 
-                try:
-                    merged_soil_data, merged_sample_data = merge_data(
-                        soil_data, sample_data, debug=False
-                    )
-                    final_data = merge_soil_and_sample_data(
-                        merged_soil_data, merged_sample_data
-                    )
+                    # Step 2: Merge data
+                    st.info("🧩 Merging and structuring data...")
+                
+                    try:
+                        merged_soil_data, merged_sample_data = merge_data(
+                            soil_data, sample_data, debug=False
+                        )
+                        final_data = merge_soil_and_sample_data(
+                            merged_soil_data, merged_sample_data
+                        )
                     
-                    st.session_state[f"final_data_{cache_key}"] = final_data
-                    progress_bar.progress(100)
-                    st.success("✅ Processing complete!")
+                        st.session_state[f"final_data_{cache_key}"] = final_data
+                        progress_bar.progress(100)
+                        st.success("✅ Processing complete!")
                     
-                except Exception as e:
-                    st.error(f"❌ Error during data merging: {e}")
-                    return
+                    except Exception as e:
+                        st.error(f"❌ Error during data merging: {e}")
+                        return
         
         # Display results
         final_data = st.session_state.get(f"final_data_{cache_key}")
         if final_data:
-            display_hole_data(final_data)
+            display_hole_data(final_data, st.session_state.get(f"usage_{cache_key}"))
+        map_boreholes = st.session_state.get(f"map_boreholes_{cache_key}")
+        if map_boreholes:
+            display_map_boreholes(map_boreholes)
 
 def main():
     """Main application function"""
@@ -289,7 +299,7 @@ def main():
         
         if st.button("🗑️ Clear Cache"):
             for key in list(st.session_state.keys()):
-                if key.startswith("final_data_") or key == "selected_hole":
+                if key.startswith(("final_data_", "usage_", "map_boreholes_")) or key == "selected_hole":
                     del st.session_state[key]
             st.success("Cache cleared!")
             st.rerun()
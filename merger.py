@@ -0,0 +1,74 @@
+from typing import Dict, List, Optional
+
+from utils import merge_data, merge_soil_and_sample_data
+
+
+class IncrementalMerger:
+    """Builds boreholes from page results as they stream in, in any order.
+
+    add() takes the (page_index, kind, result) items of utils.stream_page_results, where
+    an error record counts as the page's result for that kind. A page is complete once
+    every kind in kinds has arrived. The pages of a borehole are contiguous in a report,
+    so a borehole is finished as soon as every page before the first page of the next
+    borehole is complete; add() returns it then, merged exactly like merge_data followed
+    by merge_soil_and_sample_data. finish() returns whatever is left at the end of the
+    document. A borehole that gets more pages after it was returned is returned again,
+    with all of them, by finish().
+    """
+
+    def __init__(self, kinds=("soil", "sample")):
+        self.kinds = tuple(kinds)
+        self.pages: Dict[int, Dict[str, dict]] = {}
+        # Page results per HOLE_NO and kind, keyed by page index to restore page order
+        self.holes: Dict[str, Dict[str, Dict[int, dict]]] = {}
+        self.frontier = 0
+        self.current_hole: Optional[str] = None
+        self.emitted = set()
+        self.updated = set()
+
+    def add(self, page_index: int, kind: str, result: dict) -> List[dict]:
+        self.pages.setdefault(page_index, {})[kind] = result
+        if "error" not in result:
+            hole_no = result['metadata']['HOLE_NO']
+            self.holes.setdefault(hole_no, {}).setdefault(kind, {})[page_index] = result
+            if hole_no in self.emitted:
+                self.updated.add(hole_no)
+        return [borehole for hole_no in self._advance() for borehole in self.merge_hole(hole_no)]
+
+    def _advance(self):
+        # Walk over the complete pages at the front; a change of HOLE_NO closes the previous run.
+        # A hole that comes back later in the walk (A, B, A) is only returned once
+        finished = []
+        while len(self.pages.get(self.frontier, ())) == len(self.kinds):
+            hole_no = self._page_hole(self.frontier)
+            if hole_no is not None and hole_no != self.current_hole:
+                if self.current_hole is not None and self.current_hole not in self.emitted:
+                    finished.append(self.current_hole)
+                    self.emitted.add(self.current_hole)
+                self.current_hole = hole_no
+            self.frontier += 1
+        return finished
+
+    def _page_hole(self, page_index):
+        for kind in self.kinds:
+            result = self.pages[page_index][kind]
+            if "error" not in result:
+                return result['metadata']['HOLE_NO']
+        return None
+
+    def finish(self) -> List[dict]:
+        # Every remaining borehole, plus the ones that changed after they were returned
+        remaining = [hole_no for hole_no in self.holes if hole_no not in self.emitted or hole_no in self.updated]
+        self.emitted.update(remaining)
+        self.updated.clear()
+        return [borehole for hole_no in remaining for borehole in self.merge_hole(hole_no)]
+
+    def merge_hole(self, hole_no: str) -> List[dict]:
+        # merge_soil_and_sample_data output for one HOLE_NO (empty when it has no soil pages)
+        hole = self.holes.get(hole_no, {})
+        soil_pages = hole.get("soil", {})
+        sample_pages = hole.get("sample", {})
+        merged_soil, merged_sample = merge_data(
+            [soil_pages[i] for i in sorted(soil_pages)], [sample_pages[i] for i in sorted(sample_pages)]
+        )
+        return merge_soil_and_sample_data(merged_soil, merged_sample)
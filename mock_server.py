@@ -0,0 +1,209 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import threading
+import time
+from typing import Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+
+MODEL_ID = "mock-vision-model"
+# Metadata fields missing from the replayed outputs (they only keep HOLE_NO)
+DEFAULT_METADATA = {
+    "PROJECT_NAME": "마포로 1구역 58-2지구 개발사업 지반조사용역",
+    "HOLE_NO": "BH-1",
+    "Excavation_level": 0.0,
+    "LOCATION": "서울특별시 마포구 독막로 319번지",
+    "GROUND_WATER_LEVEL": 11.2,
+    "DATE": "2021.10.15 ~ 2021.10.15",
+    "DRILLER": "최재필",
+}
+
+
+class MockSettings:
+    """Latency model of the fake server.
+
+    A request waits for one of max_num_seqs slots, then takes prefill_s (prefill_cached_s
+    when its image was seen before, like vLLM's prefix cache) plus one token per
+    1 / decode_tokens_per_s for its answer, counted at four characters per token.
+    """
+
+    def __init__(self, max_num_seqs=16, prefill_s=0.5, prefill_cached_s=0.05, decode_tokens_per_s=400.0,
+                 fail_rate=0.0, soil_path="output_soil_data.json", sample_path="output_sample_data.json"):
+        self.max_num_seqs = max_num_seqs
+        self.prefill_s = prefill_s
+        self.prefill_cached_s = prefill_cached_s
+        self.decode_tokens_per_s = decode_tokens_per_s
+        self.fail_rate = fail_rate
+        with open(soil_path, encoding="utf-8") as f:
+            self.soil_data = json.load(f)
+        with open(sample_path, encoding="utf-8") as f:
+            self.sample_data = json.load(f)
+
+
+def create_app(settings: Optional[MockSettings] = None) -> FastAPI:
+    """OpenAI-compatible chat server that replays the bundled output_*.json extractions."""
+    settings = settings or MockSettings()
+    app = FastAPI(title="Mock vision model server")
+    slots = asyncio.Semaphore(settings.max_num_seqs)
+    seen_images = set()
+    stats = {"requests": 0, "by_schema": {}, "failures": 0, "prefix_cache_queries": 0, "prefix_cache_hits": 0,
+             "running": 0, "waiting": 0}
+
+    def answer(schema, image_key):
+        # Pages are mapped onto the replayed holes by image hash, so both calls for a page agree
+        properties = schema.get("properties", {})
+        hole = int(image_key[:8], 16) % len(settings.soil_data)
+        metadata = {**DEFAULT_METADATA, **settings.soil_data[hole]["metadata"]}
+        if "page_type" in properties:
+            return {"page_type": "table"}
+        if properties.get("metadata", {}).get("type") == "array":
+            return {"metadata": [{"Name": metadata["HOLE_NO"], "Number": hole + 1, "Excavation_level": 0.0}]}
+        result = {}
+        if "metadata" in properties:
+            result["metadata"] = metadata
+        if "soil_data" in properties:
+            result["soil_data"] = settings.soil_data[hole]["soil_data"]
+        if "sample_data" in properties:
+            result["sample_data"] = settings.sample_data[hole % len(settings.sample_data)]["sample_data"]
+        return result
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": MODEL_ID, "object": "model", "created": 0, "owned_by": "mock"}]}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        content = body["messages"][0]["content"]
+        images = [part["image_url"]["url"] for part in content if part["type"] == "image_url"]
+        prompt = "".join(part["text"] for part in content if part["type"] == "text")
+        image_key = hashlib.sha256("".join(images).encode("utf-8")).hexdigest()
+        schema = body["response_format"]["json_schema"]["schema"]
+        schema_name = schema.get("title", "unknown")
+        stats["requests"] += 1
+        stats["by_schema"][schema_name] = stats["by_schema"].get(schema_name, 0) + 1
+
+        stats["waiting"] += 1
+        async with slots:
+            stats["waiting"] -= 1
+            stats["running"] += 1
+            # A streamed answer hands its running count to stream_chunks, which drops it at the end
+            streaming = False
+            try:
+                if random.random() < settings.fail_rate:
+                    stats["failures"] += 1
+                    return JSONResponse({"error": {"message": "mock failure"}}, status_code=503)
+                cached = image_key in seen_images
+                seen_images.add(image_key)
+                prompt_tokens = len(prompt) // 4 + 1000 * len(images)
+                stats["prefix_cache_queries"] += prompt_tokens
+                stats["prefix_cache_hits"] += 1000 * len(images) if cached else 0
+                await asyncio.sleep(settings.prefill_cached_s if cached else settings.prefill_s)
+
+                text = json.dumps(answer(schema, image_key), ensure_ascii=False)
+                completion_tokens = len(text) // 4 + 1
+                usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                         "total_tokens": prompt_tokens + completion_tokens}
+                if body.get("stream"):
+                    streaming = True
+                    return StreamingResponse(
+                        stream_chunks(text, settings.decode_tokens_per_s, usage, stats,
+                                      (body.get("stream_options") or {}).get("include_usage", False)),
+                        media_type="text/event-stream",
+                    )
+                await asyncio.sleep(completion_tokens / settings.decode_tokens_per_s)
+            finally:
+                if not streaming:
+                    stats["running"] -= 1
+        return {
+            "id": f"chatcmpl-{stats['requests']}", "object": "chat.completion", "created": int(time.time()),
+            "model": MODEL_ID,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": usage,
+        }
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def metrics():
+        # The subset of vLLM's Prometheus metrics the API reads
+        return (
+            f'vllm:num_requests_running{{model_name="{MODEL_ID}"}} {stats["running"]}\n'
+            f'vllm:num_requests_waiting{{model_name="{MODEL_ID}"}} {stats["waiting"]}\n'
+            f'vllm:prefix_cache_queries_total{{model_name="{MODEL_ID}"}} {stats["prefix_cache_queries"]}\n'
+            f'vllm:prefix_cache_hits_total{{model_name="{MODEL_ID}"}} {stats["prefix_cache_hits"]}\n'
+        )
+
+    @app.get("/mock/stats")
+    async def get_stats():
+        return stats
+
+    @app.post("/mock/reset")
+    async def reset():
+        seen_images.clear()
+        stats.update(requests=0, by_schema={}, failures=0, prefix_cache_queries=0, prefix_cache_hits=0)
+        return stats
+
+    return app
+
+
+async def stream_chunks(text, decode_tokens_per_s, usage, stats, include_usage=False, chunk_chars=16):
+    # Streamed answers occupy their slot until the last chunk, like the real server
+    try:
+        for i in range(0, len(text), chunk_chars):
+            chunk = {"id": "chatcmpl-stream", "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": MODEL_ID,
+                     "choices": [{"index": 0, "delta": {"content": text[i:i + chunk_chars]}, "finish_reason": None}]}
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            await asyncio.sleep(chunk_chars / 4 / decode_tokens_per_s)
+        if include_usage:
+            chunk = {"id": "chatcmpl-stream", "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": MODEL_ID, "choices": [], "usage": usage}
+            yield f"data: {json.dumps(chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+    finally:
+        stats["running"] -= 1
+
+
+class BackgroundServer:
+    """Runs the mock server on a background thread, e.g. for the benchmark."""
+
+    def __init__(self, settings: Optional[MockSettings] = None, host: str = "127.0.0.1", port: int = 8765):
+        self.base_url = f"http://{host}:{port}/v1"
+        self.server = uvicorn.Server(uvicorn.Config(create_app(settings), host=host, port=port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            if not self.thread.is_alive():
+                # uvicorn logs the reason (e.g. the port is taken) and returns from run()
+                raise RuntimeError(f"Mock server failed to start on {self.base_url}")
+            time.sleep(0.05)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.server.should_exit = True
+        self.thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible vision server for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max-num-seqs", type=int, default=16)
+    parser.add_argument("--prefill-s", type=float, default=0.5)
+    parser.add_argument("--prefill-cached-s", type=float, default=0.05)
+    parser.add_argument("--decode-tokens-per-s", type=float, default=400.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    settings = MockSettings(args.max_num_seqs, args.prefill_s, args.prefill_cached_s, args.decode_tokens_per_s,
+                            args.fail_rate)
+    uvicorn.run(create_app(settings), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
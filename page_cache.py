@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from typing import Optional
+
+DEFAULT_CACHE_PATH = os.getenv("PAGE_CACHE_PATH", "page_cache.sqlite3")
+DEFAULT_CACHE_MAX_BYTES = int(os.getenv("PAGE_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+# Hits only refresh last_access for LRU eviction, so they are written in batches of this
+# many (or with the next put) instead of one commit per lookup
+ACCESS_FLUSH_SIZE = 64
+
+
+class PageResultCache:
+    """Persistent SQLite cache of model responses keyed by page image, prompt, schema and model."""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: int = DEFAULT_CACHE_MAX_BYTES,
+                 enabled: bool = True):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        # Running SUM(size), read once when the database is opened
+        self._total_bytes = 0
+        self._pending_access = {}
+        # Streamlit reruns scripts on worker threads, so access is serialised
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(base64_image: str, prompt: str, schema_json: str, model: str) -> str:
+        digest = hashlib.sha256()
+        for part in (base64_image, prompt, schema_json, model):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT value FROM page_results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._pending_access[key] = time.time()
+            if len(self._pending_access) >= ACCESS_FLUSH_SIZE:
+                self._flush_access(conn)
+                conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, value: str):
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            conn = self._connect()
+            replaced = conn.execute("SELECT size FROM page_results WHERE key = ?", (key,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO page_results (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time()),
+            )
+            self._total_bytes += size - (replaced[0] if replaced else 0)
+            self._flush_access(conn)
+            self._evict(conn)
+            conn.commit()
+
+    def flush(self):
+        # Write the batched last_access updates, e.g. before the process exits
+        with self._lock:
+            if self._pending_access:
+                conn = self._connect()
+                self._flush_access(conn)
+                conn.commit()
+
+    def clear(self):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM page_results")
+            conn.commit()
+            self._total_bytes = 0
+            self._pending_access.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            conn = self._connect()
+            entries = conn.execute("SELECT COUNT(*) FROM page_results").fetchone()[0]
+            total_bytes = self._total_bytes
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": entries,
+            "bytes": total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _connect(self):
+        # Opened lazily so importing utils never touches the disk
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS page_results ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS page_results_last_access ON page_results (last_access)"
+            )
+            self._conn.commit()
+            self._total_bytes = self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM page_results"
+            ).fetchone()[0]
+        return self._conn
+
+    def _flush_access(self, conn):
+        if self._pending_access:
+            conn.executemany(
+                "UPDATE page_results SET last_access = ? WHERE key = ?",
+                [(accessed, key) for key, accessed in self._pending_access.items()],
+            )
+            self._pending_access.clear()
+
+    def _evict(self, conn):
+        # Drop least recently used entries until the cache fits in max_bytes again
+        if self._total_bytes <= self.max_bytes:
+            return
+        for key, size in conn.execute(
+            "SELECT key, size FROM page_results ORDER BY last_access ASC"
+        ).fetchall():
+            conn.execute("DELETE FROM page_results WHERE key = ?", (key,))
+            self._total_bytes -= size
+            if self._total_bytes <= self.max_bytes:
+                break
+
+
+@lru_cache(maxsize=None)
+def schema_json(schema) -> str:
+    # Part of every cache key; generated once per schema class
+    return json.dumps(schema.model_json_schema(), sort_keys=True)
+
+
+# Process-wide cache shared by make_api_call; set PAGE_CACHE_DISABLED=1 to turn it off
+page_cache = PageResultCache(enabled=os.getenv("PAGE_CACHE_DISABLED", "") != "1")
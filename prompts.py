@@ -1,8 +1,9 @@
 prompt_cls= """This image is part of a set of engineering documents. Based on its contents, classify it as either:
 - "map" if it is a Boring Location Map (shows locations or layout)
 - "table" if it is a Drill Log (shows tabular data about drilling)
+- "other" for anything else (cover sheets, legends, text pages)
 
-Return just one word: "map" or "table"."""
+Return just one word: "map", "table" or "other"."""
 prompt_table = """
 You are an expert in korean and detecting table data:
 Your are given an image of a borehole drill report, where the top section contain meta data informations like
@@ -105,14 +106,19 @@ Now given an image with this map your job is to return a json in below format
 Please return Json only
 """
 
-prompt_soil_data = """You are an expert in Korean and detecting table data. You are given an image of a borehole drill report, where the top section contains metadata information such as:
+# Instructions shared by every drill-log table prompt. Each prompt starts with this exact text
+# (after the page image, see make_api_call) so vLLM's prefix cache reuses the image and
+# preamble prefill across the soil, sample and combined calls for the same page.
+table_preamble = """You are an expert in Korean and detecting table data. You are given an image of a borehole drill report, where the top section contains metadata information such as:
 PROJECT NAME, HOLE NO., ELEV, LOCATION, GROUND WATER LEVEL, DATE, and DRILLER.
 
 Below the metadata, you will find a table. The leftmost column represents the depth of the drill in meters. The rightmost three columns provide information about sample collection, such as sample number, depth of collection (in meters), and the collection method. However, DO NOT include any symbols in the collection method column.
 
 There are also columns titled "타격회수" and "관입량", which represent the number of hits corresponding to the sample.
 
-The focus of this task is to extract the **metadata** and **soil data** from the table. The soil data consists of:
+"""
+
+prompt_soil_data = table_preamble + """The focus of this task is to extract the **metadata** and **soil data** from the table. The soil data consists of:
 1. **Depth Range**: The range of depth in meters (e.g., 0.0~5.0m).IT MUST BE IN THE FORM OF "0.0~5.0m" OR "5.0~7.0m" ETC.
 2. **Soil Name**: The name of the soil.
 3. **Soil Color**: The color of the soil.
@@ -148,14 +154,7 @@ Please return the data in JSON format as shown below:
 }
 Please return **only the JSON**.
 """
-prompt_sample_data = """You are an expert in Korean and detecting table data. You are given an image of a borehole drill report, where the top section contains metadata information such as:
-PROJECT NAME, HOLE NO., ELEV, LOCATION, GROUND WATER LEVEL, DATE, and DRILLER.
-
-Below the metadata, you will find a table. The leftmost column represents the depth of the drill in meters. The rightmost three columns provide information about sample collection, such as sample number, depth of collection (in meters), and the collection method. However, DO NOT include any symbols in the collection method column.
-
-There are also columns titled "타격회수" and "관입량", which represent the number of hits corresponding to the sample.
-
-The focus of this task is to extract the **metadata** and **sample data** from the table. The sample data consists of:
+prompt_sample_data = table_preamble + """The focus of this task is to extract the **metadata** and **sample data** from the table. The sample data consists of:
 1. **Sample Number**: The sample ID (e.g., S1, S2, etc.).
 2. **Depth**: The depth at which the sample was collected (in meters).
 3. **Hits**: The number of hits recorded for the sample. IT IS ALSO CALLED "N VALUE" AND ALL THE ENTRIES IN THIS COLUMN ARE IN FORM OF FRACTION (e.g., 10/30, 20/40, etc.).
@@ -190,4 +189,66 @@ Please return the data in JSON format as shown below:
   ]
 }
 Please return **only the JSON**.
-"""
\ No newline at end of file
+"""
+prompt_combined_data = table_preamble + """The focus of this task is to extract the **metadata**, the **soil data** and the **sample data** from the table in a single pass.
+
+The soil data consists of:
+1. **Depth Range**: The range of depth in meters (e.g., 0.0~5.0m).IT MUST BE IN THE FORM OF "0.0~5.0m" OR "5.0~7.0m" ETC.
+2. **Soil Name**: The name of the soil.
+3. **Soil Color**: The color of the soil.
+4. **Observation**: Any additional observations or notes about the soil at that depth range.
+
+The sample data consists of:
+1. **Sample Number**: The sample ID (e.g., S1, S2, etc.).
+2. **Depth**: The depth at which the sample was collected (in meters).
+3. **Hits**: The number of hits recorded for the sample. IT IS ALSO CALLED "N VALUE" AND ALL THE ENTRIES IN THIS COLUMN ARE IN FORM OF FRACTION (e.g., 10/30, 20/40, etc.).
+4. **Method**: The method of sample collection, described in the metadata section (DO NOT include symbols).
+
+Please return the data in JSON format as shown below:
+
+{
+  "metadata": {
+    "PROJECT NAME": "--------",
+    "HOLE NO.": "--------",
+    "ELEV": "--------",
+    "LOCATION": "--------",
+    "GROUND WATER LEVEL": "--------",
+    "DATE": "--------",
+    "DRILLER": "--------"
+  },
+  "soil_data": [
+    {
+      "depth_range": "0.0~5.0m",
+      "soil_name": "--------",
+      "soil_color": "--------",
+      "observation": "--------"
+    },
+    ...
+  ],
+  "sample_data": [
+    {
+      "sample_number": "S1",
+      "Depth": "5.0m",
+      "Hits": "10/30",
+      "Method": "----"
+    },
+    ...
+  ]
+}
+Please return **only the JSON**.
+"""
+
+# Appended to the extraction prompts when the page metadata was already read elsewhere,
+# so the model only transcribes the table rows
+rows_only_note = """
+The metadata of this page is already known. DO NOT return the "metadata" object; return only the table rows, i.e. the JSON above without its "metadata" key.
+"""
+
+prompt_soil_rows = prompt_soil_data + rows_only_note
+prompt_sample_rows = prompt_sample_data + rows_only_note
+prompt_combined_rows = prompt_combined_data + rows_only_note
+
+# Sent once when an answer doesn't validate against the schema; {errors} lists what was wrong
+repair_note = """
+Your previous answer did not match the required JSON schema ({errors}). Answer again with ONLY the JSON, following the schema exactly.
+"""
@@ -1,5 +1,8 @@
 from pydantic import BaseModel
 from typing import List, Optional, Literal
+# For page classification
+class PageClass(BaseModel):
+    page_type: Literal["map", "table", "other"]
 # For map data extraction
 class Borehole(BaseModel):
     Name: str
@@ -35,4 +38,20 @@ class Soil(BaseModel):
 
 class MetadataAndSoilData(BaseModel):
     metadata: Metadata
-    soil_data: List[Soil]
\ No newline at end of file
+    soil_data: List[Soil]
+
+class MetadataAndTableData(BaseModel):
+    metadata: Metadata
+    soil_data: List[Soil]
+    sample_data: List[Sample]
+
+# Row-only schemas for pages whose metadata is already known (e.g. from the PDF text layer)
+class SoilRows(BaseModel):
+    soil_data: List[Soil]
+
+class SampleRows(BaseModel):
+    sample_data: List[Sample]
+
+class TableRows(BaseModel):
+    soil_data: List[Soil]
+    sample_data: List[Sample]
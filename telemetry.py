@@ -0,0 +1,85 @@
+import time
+from contextlib import contextmanager, nullcontext
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+try:
+    # Spans are exported only when an OpenTelemetry SDK is configured (e.g. opentelemetry-instrument);
+    # with just the API installed they are no-ops, and without it tracing is skipped entirely
+    from opentelemetry import trace
+    tracer = trace.get_tracer("drill_log_extraction")
+except ImportError:
+    tracer = None
+
+# Buckets (seconds) from a cached page answer up to a slow PDF; stages range over both
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+
+STAGE_SECONDS = Histogram(
+    "drill_log_stage_seconds", "Wall time of pipeline stages (download, classify, render, encode, "
+    "extraction, merge, pdf)", ["stage"], buckets=DURATION_BUCKETS
+)
+MODEL_CALL_SECONDS = Histogram(
+    "drill_log_model_call_seconds", "Latency of single model requests by response schema and outcome",
+    ["schema", "outcome"], buckets=DURATION_BUCKETS
+)
+MODEL_TOKENS = Counter(
+    "drill_log_model_tokens_total", "Tokens reported in completion.usage by response schema",
+    ["schema", "kind"]
+)
+MODEL_CALL_ERRORS = Counter(
+    "drill_log_model_call_errors_total", "Failed model requests (retried or not) by schema and error type",
+    ["schema", "error"]
+)
+MODEL_CALLS_IN_FLIGHT = Gauge("drill_log_model_calls_in_flight", "Model requests currently in flight")
+CONCURRENCY_LIMIT = Gauge("drill_log_concurrency_limit", "Current cap on in-flight model requests")
+PAGE_CACHE_LOOKUPS = Counter("drill_log_page_cache_lookups_total", "Page cache lookups", ["result"])
+PAGE_ERRORS = Counter("drill_log_page_errors_total", "Pages left out after their calls failed", ["kind"])
+PDFS = Counter("drill_log_pdfs_total", "Processed PDFs by outcome", ["status"])
+
+
+@contextmanager
+def stage_timer(name):
+    # Times one pipeline stage into STAGE_SECONDS
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(name).observe(time.perf_counter() - start)
+
+
+@contextmanager
+def stage(name, **attributes):
+    # stage_timer inside a span of the same name
+    with span(name, **attributes), stage_timer(name):
+        yield
+
+
+def span(name, **attributes):
+    if tracer is None:
+        return nullcontext()
+    return tracer.start_as_current_span(
+        name, attributes={key: value for key, value in attributes.items() if value is not None}
+    )
+
+
+def record_model_call(schema_name, elapsed, error=None):
+    MODEL_CALL_SECONDS.labels(schema_name, "error" if error else "ok").observe(elapsed)
+    if error is not None:
+        MODEL_CALL_ERRORS.labels(schema_name, type(error).__name__).inc()
+
+
+def record_usage(schema_name, usage):
+    # usage is completion.usage; servers that don't report it are skipped
+    if usage is None:
+        return
+    MODEL_TOKENS.labels(schema_name, "prompt").inc(usage.prompt_tokens or 0)
+    MODEL_TOKENS.labels(schema_name, "completion").inc(usage.completion_tokens or 0)
+
+
+def record_cache_lookup(hit):
+    PAGE_CACHE_LOOKUPS.labels("hit" if hit else "miss").inc()
+
+
+def render_metrics():
+    """(body, content type) of the Prometheus text exposition."""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -3,8 +3,8 @@ import os
 from dotenv import load_dotenv
 
 from utils import (
-    pdf_to_images,
-    encode_image,
+    resolution_policy_from_env,
+    pdf_to_base64_images,
     process_images_in_batches,  # Using the sync version of this function
     merge_data,
     merge_soil_and_sample_data
@@ -39,25 +39,19 @@ def handle_pdf_upload():
             f.write(uploaded_pdf.getbuffer())
         st.success(f"✅ PDF uploaded: {uploaded_pdf.name}")
         
-        # 1. Convert PDF to images
+        # 1. Render the PDF at 4000px unless RENDER_* overrides are set; pages are also kept in output_dir
         output_dir = create_directories(pdf_path)
         st.info("🔄 Converting PDF to images...")
-        pdf_to_images(pdf_path, output_dir, fixed_length=4000, max_workers=4)
+        image_base64_list = list(pdf_to_base64_images(
+            pdf_path, debug_dir=output_dir, base_name=os.path.basename(output_dir), max_workers=4,
+            policy=resolution_policy_from_env(4000)
+        ))
         
-        # 2. Collect and encode image files
-        image_files = sorted([
-            os.path.join(output_dir, f) 
-            for f in os.listdir(output_dir) 
-            if f.lower().endswith((".png", ".jpg", ".jpeg"))
-        ])
-        
-        if not image_files:
-            st.error("❌ No image files found after PDF conversion.")
+        if not image_base64_list:
+            st.error("❌ No pages found in the PDF.")
             return
         
-        image_base64_list = [encode_image(image_path) for image_path in image_files]
-        
-        # 3. Process images in batches (sync version)
+        # 2. Process images in batches (sync version)
         st.info("⚙️ Processing images through the model...")
         try:
             soil_data, sample_data = process_images_in_batches(image_base64_list, base_url, api_key)
@@ -65,7 +59,7 @@ def handle_pdf_upload():
             st.error(f"❌ Error during batch processing: {e}")
             return
         
-        # 4. Merge soil and sample data
+        # 3. Merge soil and sample data
         st.info("🧩 Merging parsed data...")
         try:
             merged_soil_data, merged_sample_data = merge_data(soil_data, sample_data)
@@ -74,7 +68,7 @@ def handle_pdf_upload():
             st.error(f"❌ Error during merging data: {e}")
             return
 
-        # 5. Display buttons per HOLE_NO
+        # 4. Display buttons per HOLE_NO
         if final_data:
             display_hole_buttons(final_data)
         else:
@@ -0,0 +1,24 @@
+import asyncio
+from types import SimpleNamespace
+
+from jobs import Job
+
+
+def borehole(s3_url, hole_no, layers):
+    return {"hole_no": hole_no, "source_pdf_url": s3_url, "soil_data": [{"soil_name": "clay"}] * layers}
+
+
+def test_borehole_published_again_replaces_its_entry():
+    async def publish():
+        job = Job(SimpleNamespace(s3_urls=["s3://b/a.pdf", "s3://b/b.pdf"], pdf_id="x", user_id="u"))
+        await job.add_boreholes([borehole("s3://b/a.pdf", "A", 1), borehole("s3://b/b.pdf", "A", 1)])
+        await job.add_boreholes([borehole("s3://b/a.pdf", "B", 1)])
+        await job.add_boreholes([borehole("s3://b/a.pdf", "A", 2)])
+        return job
+
+    job = asyncio.run(publish())
+    assert [event for event, _ in job.events] == ["borehole", "borehole", "borehole", "borehole_updated"]
+    assert [(b["source_pdf_url"], b["hole_no"], len(b["soil_data"])) for b in job.boreholes] == [
+        ("s3://b/a.pdf", "A", 2), ("s3://b/b.pdf", "A", 1), ("s3://b/a.pdf", "B", 1)
+    ]
+    assert job.to_status()["boreholes_found"] == 3
@@ -0,0 +1,85 @@
+import copy
+import json
+import random
+
+from merger import IncrementalMerger
+from utils import merge_data, merge_soil_and_sample_data
+
+
+def page_results(page_index, hole_no):
+    metadata = {"HOLE_NO": hole_no}
+    soil = {"metadata": metadata, "soil_data": [
+        {"depth_range": f"{page_index}~{page_index + 1}m", "soil_name": "clay", "soil_color": "", "observation": ""}
+    ]}
+    sample = {"metadata": dict(metadata), "sample_data": [
+        {"Sample_number": f"S-{page_index + 1}", "Depth": page_index + 0.5, "Hits": "10/30", "Method": "SPT"}
+    ]}
+    return {"soil": soil, "sample": sample}
+
+
+def add_pages(merger, holes, order):
+    # Feed both results of every page in order; returns the HOLE_NOs returned by add()
+    returned = []
+    for page_index in order:
+        for kind, result in page_results(page_index, holes[page_index]).items():
+            returned.extend(borehole['metadata']['HOLE_NO'] for borehole in merger.add(page_index, kind, result))
+    return returned
+
+
+def reference(holes):
+    pages = [page_results(page_index, hole_no) for page_index, hole_no in enumerate(holes)]
+    return merge_soil_and_sample_data(*merge_data([page["soil"] for page in pages], [page["sample"] for page in pages]))
+
+
+def canonical(boreholes):
+    return sorted(json.dumps(borehole, sort_keys=True) for borehole in boreholes)
+
+
+def test_borehole_returned_once_its_run_ends():
+    merger = IncrementalMerger()
+    assert add_pages(merger, ["A", "A", "B"], [0, 1]) == []
+    assert add_pages(merger, ["A", "A", "B"], [2]) == ["A"]
+    assert [borehole['metadata']['HOLE_NO'] for borehole in merger.finish()] == ["B"]
+
+
+def test_hole_repeated_in_one_walk_is_returned_once():
+    holes = ["A", "B", "A", "B"]
+    merger = IncrementalMerger()
+    assert add_pages(merger, holes, [1, 2, 3]) == []
+    assert add_pages(merger, holes, [0]) == ["A", "B"]
+    assert merger.finish() == []
+
+
+def test_later_pages_return_the_hole_again_from_finish():
+    holes = ["A", "B", "A"]
+    merger = IncrementalMerger()
+    assert add_pages(merger, holes, [0, 1]) == ["A"]
+    assert add_pages(merger, holes, [2]) == ["B"]
+    finished = merger.finish()
+    assert [borehole['metadata']['HOLE_NO'] for borehole in finished] == ["A"]
+    assert [soil['depth_range'] for soil in finished[0]['soil_data']] == ["0~1m", "2~3m"]
+
+
+def test_failed_pages_do_not_block_or_split_a_hole():
+    merger = IncrementalMerger()
+    add_pages(merger, ["A"], [0])
+    for kind in ("soil", "sample"):
+        assert merger.add(1, kind, {"page_index": 1, "kind": kind, "error": "TimeoutError"}) == []
+    assert add_pages(merger, [None, None, "A", "B"], [2, 3]) == ["A"]
+    assert [borehole['metadata']['HOLE_NO'] for borehole in merger.finish()] == ["B"]
+
+
+def test_any_arrival_order_matches_merge_data():
+    rng = random.Random(7)
+    for _ in range(100):
+        holes = [f"BH-{hole}" for hole in range(rng.randint(1, 4)) for _ in range(rng.randint(1, 3))]
+        items = [
+            (page_index, kind, result)
+            for page_index, hole_no in enumerate(holes)
+            for kind, result in page_results(page_index, hole_no).items()
+        ]
+        rng.shuffle(items)
+        merger = IncrementalMerger()
+        boreholes = [borehole for item in items for borehole in merger.add(*copy.deepcopy(item))]
+        boreholes += merger.finish()
+        assert canonical(boreholes) == canonical(reference(holes))
@@ -0,0 +1,65 @@
+import fitz  # PyMuPDF
+
+from text_layer import extract_text_metadata
+
+# 9pt labels on a 14pt line pitch, as in most drill-log header tables
+FONT_SIZE = 9
+LINE_PITCH = 14
+
+
+def header_page(rows, label_x=50, value_x=150, top=60, fontname="helv"):
+    # One page with a label and a value per header row; None skips that part of the row
+    doc = fitz.open()
+    page = doc.new_page()
+    for row, (label, value) in enumerate(rows):
+        y = top + row * LINE_PITCH
+        if label:
+            page.insert_text((label_x, y), label, fontsize=FONT_SIZE, fontname=fontname)
+        if value:
+            page.insert_text((value_x, y), value, fontsize=FONT_SIZE, fontname=fontname)
+    return page
+
+
+def test_values_stay_on_their_label_row():
+    page = header_page([
+        ("PROJECT", "Mapo Redevelopment"),
+        ("HOLE NO.", "BH-1"),
+        ("ELEVATION", "12.5 m"),
+        ("LOCATION", "Seoul Mapo"),
+        ("GROUND WATER", "3.2 m"),
+    ])
+    fields, confidence = extract_text_metadata(page)
+    assert fields == {
+        "PROJECT_NAME": "Mapo Redevelopment",
+        "HOLE_NO": "BH-1",
+        "Excavation_level": 12.5,
+        "LOCATION": "Seoul Mapo",
+        "GROUND_WATER_LEVEL": 3.2,
+    }
+    assert set(confidence.values()) == {1.0}
+
+
+def test_value_wrapped_onto_a_second_line_is_not_trusted():
+    page = header_page([
+        ("HOLE NO.", "BH-1"),
+        ("LOCATION", "Seoul Mapo-gu"),
+        (None, "Mapo-ro 1"),
+    ])
+    fields, confidence = extract_text_metadata(page)
+    assert fields["LOCATION"] == "Seoul Mapo-gu Mapo-ro 1"
+    assert confidence == {"HOLE_NO": 1.0, "LOCATION": 0.5}
+
+
+def test_value_between_stacked_korean_and_english_labels():
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_font(fontname="korea", fontbuffer=fitz.Font("korea").buffer)
+    rows = [("공사명", "PROJECT", "Mapo"), ("공번", "HOLE NO.", "BH-1"), ("지반표고", "ELEVATION", "12.5 m")]
+    for row, (korean, english, value) in enumerate(rows):
+        y = 60 + row * 2 * (LINE_PITCH - 2)
+        page.insert_text((50, y), korean, fontsize=FONT_SIZE, fontname="korea")
+        page.insert_text((50, y + LINE_PITCH - 4), english, fontsize=FONT_SIZE, fontname="korea")
+        page.insert_text((150, y + (LINE_PITCH - 4) / 2), value, fontsize=FONT_SIZE, fontname="korea")
+    fields, confidence = extract_text_metadata(page)
+    assert fields == {"PROJECT_NAME": "Mapo", "HOLE_NO": "BH-1", "Excavation_level": 12.5}
+    assert set(confidence.values()) == {1.0}
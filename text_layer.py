@@ -0,0 +1,149 @@
+import re
+from typing import Dict, Optional, Tuple
+
+import fitz  # PyMuPDF
+from pydantic import ValidationError
+
+from pydantic_models import Metadata
+
+# Header labels (Korean and English, spaces ignored) for every Metadata field
+METADATA_LABELS = {
+    "PROJECT_NAME": ["PROJECT", "PROJECTNAME", "공사명", "사업명"],
+    "HOLE_NO": ["HOLENO", "HOLENO.", "BORINGNO", "BORINGNO.", "공번", "시추공번"],
+    "Excavation_level": ["ELEVATION", "ELEV", "ELEV.", "지반표고", "표고"],
+    "LOCATION": ["LOCATION", "위치"],
+    "GROUND_WATER_LEVEL": ["GROUNDWATER", "GROUNDWATERLEVEL", "G.W.L", "지하수위"],
+    "DATE": ["DATE", "날짜", "조사일자", "시추일자"],
+    "DRILLER": ["DRILLER", "INSPECTOR", "시추자", "감독자"],
+}
+FLOAT_FIELDS = {"Excavation_level", "GROUND_WATER_LEVEL"}
+NUMBER_PATTERN = re.compile(r"-?\d+(?:\.\d+)?")
+# Labels are at most this many words long, e.g. "HOLE" "No." or "공" "사" "명"
+MAX_LABEL_WORDS = 4
+# Fraction of the page height searched for header labels when no region is given
+DEFAULT_HEADER_FRACTION = 0.3
+
+
+def _normalise(text: str) -> str:
+    return re.sub(r"\s+", "", text).upper()
+
+
+def _find_labels(words):
+    # Match runs of up to MAX_LABEL_WORDS words on one line against the label table
+    lookup = {_normalise(label): field for field, labels in METADATA_LABELS.items() for label in labels}
+    lines = {}
+    for word in words:
+        lines.setdefault((word[5], word[6]), []).append(word)
+
+    found = []
+    for line_words in lines.values():
+        line_words.sort(key=lambda word: word[0])
+        i = 0
+        while i < len(line_words):
+            for size in range(min(MAX_LABEL_WORDS, len(line_words) - i), 0, -1):
+                run = line_words[i:i + size]
+                field = lookup.get(_normalise("".join(word[4] for word in run)))
+                if field:
+                    found.append((field, (run[0][0], min(w[1] for w in run), run[-1][2], max(w[3] for w in run)), run))
+                    i += size
+                    break
+            else:
+                i += 1
+    return found
+
+
+def _row_bounds(field, label_box, labels):
+    # Vertical extent of a label's row: halfway to the nearest label of another field above
+    # and below it in the same label column, so a value never reaches into the next rows
+    x0, y0, x1, y1 = label_box
+    middle = (y0 + y1) / 2
+    top, bottom = float("-inf"), float("inf")
+    for other_field, (other_x0, other_y0, other_x1, other_y1), _ in labels:
+        if other_field == field or other_x0 >= x1 or other_x1 <= x0:
+            continue
+        other_middle = (other_y0 + other_y1) / 2
+        if other_middle < middle:
+            top = max(top, (middle + other_middle) / 2)
+        elif other_middle > middle:
+            bottom = min(bottom, (middle + other_middle) / 2)
+    return top, bottom
+
+
+def _value_right_of(label_box, words, label_words, label_left_edges, row_bounds):
+    # Value words sit to the right of the label, vertically overlapping it (Korean and
+    # English labels are stacked, so half a line of slack is allowed, but never past the
+    # row's bounds), and end at the next label column. Also returns whether the value
+    # spans more than one text line.
+    x0, y0, x1, y1 = label_box
+    slack = (y1 - y0) * 0.75
+    top = max(y0 - slack, row_bounds[0])
+    bottom = min(y1 + slack, row_bounds[1])
+    limit = min([edge for edge in label_left_edges if edge > x1], default=float("inf"))
+    value_words = [
+        word for word in words
+        if word[0] >= x1 and word[2] <= limit and id(word) not in label_words
+        and top <= (word[1] + word[3]) / 2 <= bottom
+    ]
+    value_words.sort(key=lambda word: (round(word[1]), word[0]))
+    middles = [(word[1] + word[3]) / 2 for word in value_words]
+    several_lines = bool(middles) and max(middles) - min(middles) > (y1 - y0) / 2
+    return " ".join(word[4] for word in value_words).strip(), several_lines
+
+
+def extract_text_metadata(page, header_region=None) -> Tuple[Dict[str, object], Dict[str, float]]:
+    """Read Metadata fields from the page's text layer.
+
+    Returns (fields, confidence) where confidence is 1.0 for a field found once with a
+    parsable value, 0.5 when its label appears several times with differing values or its
+    value spans several text lines, and fields that were not found are missing from both
+    dicts.
+    """
+    clip = header_region
+    if clip is None:
+        rect = page.rect
+        clip = fitz.Rect(rect.x0, rect.y0, rect.x1, rect.y0 + rect.height * DEFAULT_HEADER_FRACTION)
+    words = page.get_text("words", clip=clip)
+    if not words:
+        return {}, {}
+
+    labels = _find_labels(words)
+    label_words = {id(word) for _, _, run in labels for word in run}
+    label_left_edges = [box[0] for _, box, _ in labels]
+
+    values = {}
+    wrapped = set()
+    for field, box, _ in labels:
+        value, several_lines = _value_right_of(
+            box, words, label_words, label_left_edges, _row_bounds(field, box, labels)
+        )
+        if not value:
+            continue
+        if field in FLOAT_FIELDS:
+            match = NUMBER_PATTERN.search(value)
+            if not match:
+                continue
+            value = float(match.group())
+        values.setdefault(field, []).append(value)
+        if several_lines:
+            wrapped.add(field)
+
+    fields = {}
+    confidence = {}
+    for field, found in values.items():
+        fields[field] = found[0]
+        confidence[field] = 1.0 if len(set(map(str, found))) == 1 and field not in wrapped else 0.5
+    return fields, confidence
+
+
+def trusted_fields(fields: Dict[str, object], confidence: Dict[str, float],
+                   min_confidence: float = 1.0) -> Dict[str, object]:
+    return {field: value for field, value in fields.items() if confidence.get(field, 0) >= min_confidence}
+
+
+def complete_metadata(fields: Dict[str, object], confidence: Dict[str, float],
+                      min_confidence: float = 1.0) -> Optional[dict]:
+    # The whole Metadata object when every field is trusted, so the model can skip it
+    try:
+        return Metadata.model_validate(trusted_fields(fields, confidence, min_confidence)).model_dump()
+    except ValidationError:
+        return None
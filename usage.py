@@ -0,0 +1,110 @@
+import json
+import os
+import threading
+import time
+from typing import List, Optional
+
+# Pages listed as the most expensive of a PDF in its usage summary
+TOP_PAGES = 5
+
+
+def _totals(records) -> dict:
+    requests = [record for record in records if not record.get("cached")]
+    latencies = [record["latency_s"] for record in requests]
+    prompt_tokens = sum(record.get("prompt_tokens") or 0 for record in records)
+    completion_tokens = sum(record.get("completion_tokens") or 0 for record in records)
+    return {
+        "calls": len(records),
+        "cached_calls": len(records) - len(requests),
+        "failed_calls": sum(1 for record in records if record.get("error")),
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "latency_s": round(sum(latencies, 0.0), 3),
+        "max_latency_s": round(max(latencies), 3) if latencies else 0.0,
+    }
+
+
+def summarize_calls(records: List[dict], top_pages: int = TOP_PAGES) -> dict:
+    """Token, call and latency totals over model call records (see utils.call_model).
+
+    Adds a breakdown by prompt (response schema) and, for records with a page_number, the
+    top_pages pages with the most tokens together with their image sizes. Cached answers
+    count as calls but carry no tokens.
+    """
+    summary = _totals(records)
+    by_prompt = {}
+    for record in records:
+        by_prompt.setdefault(record["schema"], []).append(record)
+    summary["by_prompt"] = {schema: _totals(schema_records) for schema, schema_records in by_prompt.items()}
+
+    by_page = {}
+    for record in records:
+        if record.get("page_number") is not None:
+            by_page.setdefault(record["page_number"], []).append(record)
+    pages = [
+        {"page_number": page_number, "image_size": page_records[0].get("image_size"), **_totals(page_records)}
+        for page_number, page_records in by_page.items()
+    ]
+    if pages:
+        pages.sort(key=lambda page: page["total_tokens"], reverse=True)
+        summary["pages"] = len(pages)
+        summary["tokens_per_page"] = round(summary["total_tokens"] / len(pages), 1)
+        summary["top_pages"] = pages[:top_pages]
+    return summary
+
+
+def combine_summaries(summaries: List[dict]) -> dict:
+    # Job-level totals from per-PDF summaries; pages stay in the per-PDF summaries
+    combined = {}
+    by_prompt = {}
+    for summary in summaries:
+        for field, value in summary.items():
+            if field == "by_prompt":
+                for schema, totals in value.items():
+                    prompt_totals = by_prompt.setdefault(schema, {})
+                    for name, total in totals.items():
+                        prompt_totals[name] = _add(name, prompt_totals.get(name), total)
+            elif field not in ("top_pages", "tokens_per_page"):
+                combined[field] = _add(field, combined.get(field), value)
+    combined["by_prompt"] = by_prompt
+    if combined.get("pages"):
+        combined["tokens_per_page"] = round(combined["total_tokens"] / combined["pages"], 1)
+    return combined
+
+
+def _add(field, total, value):
+    if total is None:
+        return value
+    return max(total, value) if field.startswith("max_") else round(total + value, 3)
+
+
+class UsageLog:
+    """Appends model call records as JSON lines, e.g. for offline analysis with pandas."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def write(self, records: List[dict], **fields):
+        # fields (e.g. s3_url, pdf_id) are added to every record
+        if not self.enabled or not records:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        logged_at = time.time()
+        lines = "".join(
+            json.dumps({"logged_at": logged_at, **fields, **record}, ensure_ascii=False) + "\n" for record in records
+        )
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+
+# Set USAGE_LOG to a file path to keep every call record
+usage_log = UsageLog(os.getenv("USAGE_LOG") or None)
+
@@ -1,129 +1,1100 @@
 import os
 import fitz  # PyMuPDF
-from concurrent.futures import ThreadPoolExecutor
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import tempfile
+import threading
 import base64
 import openai
 from io import BytesIO
 import time
-from collections import defaultdict
-from typing import List
+from collections import Counter, defaultdict, deque
+from typing import List, Optional
+from dataclasses import dataclass, field
+from contextlib import nullcontext
+from functools import lru_cache
 import re
-import json
 import asyncio
+import random
+from bisect import bisect_left, bisect_right
 from PIL import Image
+from pydantic import ValidationError
 from pydantic_models import *
-from prompts import prompt_soil_data, prompt_sample_data
-def encode_image(image_path: str) -> str:
+from prompts import (
+    prompt_soil_data, prompt_sample_data, prompt_combined_data, prompt_cls, prompt_map,
+    prompt_soil_rows, prompt_sample_rows, prompt_combined_rows, repair_note
+)
+from text_layer import extract_text_metadata, trusted_fields, complete_metadata
+from clients import client_manager
+from backends import Backend
+from page_cache import page_cache, schema_json
+from columnar import annotate_hits
+from telemetry import (
+    stage, stage_timer, span, record_model_call, record_usage, record_cache_lookup, MODEL_CALLS_IN_FLIGHT,
+    PAGE_ERRORS
+)
+def encode_image(image_path: str, max_pixels: Optional[int] = None) -> str:
     image = Image.open(image_path).convert("RGB")  # Ensure it's RGB format
+    # Downscale to the pixel budget; the model's visual token count scales with area
+    if max_pixels and image.width * image.height > max_pixels:
+        ratio = (max_pixels / (image.width * image.height)) ** 0.5
+        image = image.resize((max(1, int(image.width * ratio)), max(1, int(image.height * ratio))), Image.LANCZOS)
     buffered = BytesIO()
     image.save(buffered, format="JPEG")
     encoded_string = base64.b64encode(buffered.getvalue()).decode("utf-8")
     return encoded_string
 
-def process_page(page, scale, base_name, output_dir, page_number):
-    # Render the page to an image (pixmap) using the transformation matrix
-    matrix = fitz.Matrix(scale, scale)
-    pix = page.get_pixmap(matrix=matrix)
+# JPEG quality of page images sent to the model (same as the PIL re-encode in encode_image)
+JPEG_QUALITY = 75
+# Documents shorter than this are rendered inline; the pool hand-off costs more than it saves
+MIN_PAGES_FOR_POOL = 4
+# Pages per render task, and render tasks kept submitted per worker ahead of the consumer
+RENDER_CHUNK_PAGES = 2
+RENDER_CHUNKS_AHEAD = 2
 
-    # Define the output image path
-    image_filename = f"{base_name}_page_{page_number + 1}.jpg"
-    image_path = os.path.join(output_dir, image_filename)
+_render_pool = None
+_render_pool_lock = threading.Lock()
 
-    # Save the image in PNG format
-    pix.save(image_path)
-    return image_path
+def available_cpus():
+    # The cores this process may run on, which in a container can be far fewer than cpu_count()
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0)) or 1
+    return os.cpu_count() or 1
 
-def pdf_to_images(pdf_path, output_dir, fixed_length=1080, max_workers=4):
-    # Ensure the PDF file exists
-    if not os.path.exists(pdf_path):
-        raise FileNotFoundError(f"The file {pdf_path} does not exist.")
+def get_render_pool():
+    # One process pool per interpreter, sized to the available cores and reused across PDFs.
+    # It is first created from a worker thread while other threads may be inside PyMuPDF, so
+    # workers are started from a clean process (forkserver, or spawn) instead of fork()
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _render_pool = ProcessPoolExecutor(
+                max_workers=available_cpus(), mp_context=multiprocessing.get_context(start_method)
+            )
+    return _render_pool
 
-    # Extract the base file name (without extension) for directory naming
-    base_name = os.path.splitext(os.path.basename(pdf_path))[0]
+def reset_render_pool(pool):
+    # Replace a pool broken by a crashed worker; the next get_render_pool() starts a new one
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is pool:
+            _render_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
 
-    # Create the output directory if it doesn't exist
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-
-    # Open the PDF file using fitz (PyMuPDF)
+def open_pdf(pdf):
+    # Accept either a path on disk or the raw PDF bytes of an upload
     try:
-        doc = fitz.open(pdf_path)
+        if isinstance(pdf, (bytes, bytearray)):
+            return fitz.open(stream=pdf, filetype="pdf")
+        if not os.path.exists(pdf):
+            raise FileNotFoundError(f"The file {pdf} does not exist.")
+        return fitz.open(pdf)
+    except FileNotFoundError:
+        raise
     except Exception as e:
         raise RuntimeError(f"Failed to open PDF: {e}")
 
-    # Get the original width and height of the first page to calculate scale
-    original_width = doc[0].rect.width
+@dataclass(frozen=True)
+class ResolutionPolicy:
+    """How a page is turned into model images.
 
-    # Calculate the scaling factor to achieve the fixed height (length)
-    scale = fixed_length / original_width
+    fixed_length: rendered width in px of the page (or of the cropped region)
+    max_pixels: optional cap on width * height of every image; the scale is lowered to fit
+    crop: "none" for the full page, "table" to crop to the ruled drill-log frame
+    tiling: "none" for one image per page, "header_table" for a metadata crop plus a table crop
+    """
+    fixed_length: int = 1080
+    max_pixels: Optional[int] = None
+    crop: str = "none"
+    tiling: str = "none"
 
-    # Create a list to hold the future results of the image processing
-    file_paths = []
+def resolution_policy_from_env(default_width):
+    # RENDER_WIDTH / RENDER_MAX_PIXELS / RENDER_CROP / RENDER_TILING override the entry point defaults
+    max_pixels = os.getenv("RENDER_MAX_PIXELS")
+    return ResolutionPolicy(
+        fixed_length=int(os.getenv("RENDER_WIDTH", default_width)),
+        max_pixels=int(max_pixels) if max_pixels else None,
+        crop=os.getenv("RENDER_CROP", "none"),
+        tiling=os.getenv("RENDER_TILING", "none"),
+    )
+
+# A horizontal rule at least this fraction of the page width counts as a table border
+MIN_RULE_WIDTH = 0.5
+# A vertical rule at least this fraction of the page height counts as a table column line
+MIN_COLUMN_HEIGHT = 0.3
+# Padding in PDF points kept around detected regions
+REGION_MARGIN = 4
 
-    # Use ThreadPoolExecutor to process pages concurrently
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [
-            executor.submit(process_page, doc[page_number], scale, base_name, output_dir, page_number)
-            for page_number in range(len(doc))
-        ]
+def find_page_rules(page):
+    """Return the long horizontal rules (x0, x1, y) and the top y of every long vertical rule.
 
-        # Collect results
-        file_paths = [future.result() for future in futures]
+    Uses get_cdrawings, which is several times faster than get_drawings on CAD exports
+    where even the text is drawn as vector strokes.
+    """
+    min_width = page.rect.width * MIN_RULE_WIDTH
+    min_height = page.rect.height * MIN_COLUMN_HEIGHT
+    rules = []
+    column_tops = []
+    for drawing in page.get_cdrawings():
+        for item in drawing["items"]:
+            if item[0] == "l":
+                (sx, sy), (ex, ey) = item[1], item[2]
+                if abs(sy - ey) < 1 and abs(sx - ex) >= min_width:
+                    rules.append((min(sx, ex), max(sx, ex), sy))
+                elif abs(sx - ex) < 1 and abs(sy - ey) >= min_height:
+                    column_tops.append(min(sy, ey))
+            elif item[0] == "re":
+                x0, y0, x1, y1 = item[1]
+                if x1 - x0 >= min_width and y1 - y0 < 1:
+                    rules.append((x0, x1, y0))
+    return rules, column_tops
 
-    # Close the document
-    doc.close()
+def detect_page_regions(page, rules=None, column_tops=None):
+    """Find the drill-log frame from the page's long vector rules.
+
+    Returns (table_region, header_region, body_region) as fitz.Rect, or None when the page
+    has too few vector rules (e.g. scanned pages) and should be sent whole.
+    Most table columns start at the same y; the last horizontal rule above it opens the
+    column-header band (start of the body) and the rule before that opens the metadata header.
+    """
+    if rules is None or column_tops is None:
+        rules, column_tops = find_page_rules(page)
+    ys = sorted({round(y, 1) for _, _, y in rules})
+    if len(ys) < 3 or not column_tops:
+        return None
+    column_top = Counter(round(y, 1) for y in column_tops).most_common(1)[0][0]
+    above = [y for y in ys if y < column_top - 1]
+    if len(above) < 2:
+        return None
+
+    header_top, body_top, bottom = above[-2], above[-1], ys[-1]
+    x0 = min(rule[0] for rule in rules) - REGION_MARGIN
+    x1 = max(rule[1] for rule in rules) + REGION_MARGIN
+    return (
+        fitz.Rect(x0, header_top - REGION_MARGIN, x1, bottom + REGION_MARGIN) & page.rect,
+        fitz.Rect(x0, header_top - REGION_MARGIN, x1, body_top + REGION_MARGIN) & page.rect,
+        fitz.Rect(x0, body_top - REGION_MARGIN, x1, bottom + REGION_MARGIN) & page.rect,
+    )
+
+def render_region(page, region, policy, jpeg_quality):
+    scale = policy.fixed_length / region.width
+    if policy.max_pixels and region.width * region.height * scale * scale > policy.max_pixels:
+        scale = (policy.max_pixels / (region.width * region.height)) ** 0.5
+    pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale), clip=region)
+    return pix.tobytes("jpeg", jpg_quality=jpeg_quality)
+
+def render_page(page, policy, jpeg_quality=JPEG_QUALITY):
+    # JPEG bytes for the page, or a [header, table] list when tiling finds the frame
+    regions = detect_page_regions(page) if policy.crop != "none" or policy.tiling != "none" else None
+    if regions is None:
+        return render_region(page, page.rect, policy, jpeg_quality)
+    table_region, header_region, body_region = regions
+    if policy.tiling == "header_table":
+        return [render_region(page, header_region, policy, jpeg_quality),
+                render_region(page, body_region, policy, jpeg_quality)]
+    return render_region(page, table_region, policy, jpeg_quality)
+
+def get_page_count(pdf):
+    doc = open_pdf(pdf)
+    try:
+        return len(doc)
+    finally:
+        doc.close()
+
+def render_page_list(pdf, page_numbers, policy, jpeg_quality=JPEG_QUALITY):
+    # Runs inside a pool worker: every worker opens its own document handle, since
+    # PyMuPDF documents must not be shared between threads
+    doc = open_pdf(pdf)
+    try:
+        return [render_page(doc[page_number], policy, jpeg_quality) for page_number in page_numbers]
+    finally:
+        doc.close()
+
+def map_page_ranges(task, pdf, page_numbers, max_workers=None, *args):
+    """Yield task's per-page results in page order, running task on page ranges across processes.
+
+    task(pdf, page_numbers, *args) runs in a pool worker and returns one result per page.
+    max_workers defaults to the number of usable cores; 1 runs task in the calling process.
+    """
+    page_numbers = list(page_numbers)
+    if not page_numbers:
+        return
+    max_workers = min(max_workers or available_cpus(), len(page_numbers))
+    if max_workers <= 1 or len(page_numbers) < MIN_PAGES_FOR_POOL:
+        yield from task(pdf, page_numbers, *args)
+        return
+
+    spill_path = None
+    if isinstance(pdf, (bytes, bytearray)):
+        # Hand workers a file to open instead of pickling the whole PDF into every task
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+            f.write(pdf)
+            spill_path = f.name
+        pdf = spill_path
+    try:
+        chunks = [page_numbers[i:i + RENDER_CHUNK_PAGES] for i in range(0, len(page_numbers), RENDER_CHUNK_PAGES)]
+        done = 0
+        for retry in (False, True):
+            pool = get_render_pool()
+            submitted = deque()
+            try:
+                next_chunk = done
+                while done < len(chunks):
+                    # Chunks are submitted only as earlier ones are consumed, so a slow consumer
+                    # holds back rendering instead of piling up the rest of the document
+                    while next_chunk < len(chunks) and len(submitted) < max_workers * RENDER_CHUNKS_AHEAD:
+                        submitted.append(pool.submit(task, pdf, chunks[next_chunk], *args))
+                        next_chunk += 1
+                    chunk = submitted.popleft().result()
+                    done += 1
+                    yield from chunk
+                break
+            except BrokenProcessPool:
+                # A worker died (e.g. killed for memory); run the remaining chunks once more
+                reset_render_pool(pool)
+                if retry:
+                    raise
+                print(f"Render pool broke after {done} of {len(chunks)} chunks; restarting it")
+            finally:
+                for future in submitted:
+                    future.cancel()
+    finally:
+        if spill_path:
+            os.remove(spill_path)
+
+def render_pdf_pages(pdf, fixed_length=1080, max_workers=None, jpeg_quality=JPEG_QUALITY, policy=None,
+                     pages=None):
+    """Yield the JPEG bytes of every page in page order, rendering page ranges across processes.
+
+    max_workers defaults to the number of usable cores; 1 renders in the calling process.
+    policy (a ResolutionPolicy) overrides fixed_length; with header_table tiling a page
+    yields a list of JPEG bytes instead. pages restricts rendering to those page numbers.
+    """
+    policy = policy or ResolutionPolicy(fixed_length=fixed_length)
+    page_numbers = range(get_page_count(pdf)) if pages is None else pages
+    yield from map_page_ranges(render_page_list, pdf, page_numbers, max_workers, policy, jpeg_quality)
+
+def pdf_to_images(pdf_path, output_dir, fixed_length=1080, max_workers=4, policy=None):
+    if policy and policy.tiling != "none":
+        raise ValueError("pdf_to_images writes one file per page; use pdf_to_base64_images for tiling")
+
+    # Extract the base file name (without extension) for directory naming
+    base_name = os.path.splitext(os.path.basename(pdf_path))[0]
+
+    # Create the output directory if it doesn't exist
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    # Render across the process pool and write each page as a .jpg (quality of pix.save)
+    file_paths = []
+    for page_number, jpeg_bytes in enumerate(
+        render_pdf_pages(pdf_path, fixed_length, max_workers=max_workers, jpeg_quality=95, policy=policy)
+    ):
+        image_path = os.path.join(output_dir, f"{base_name}_page_{page_number + 1}.jpg")
+        with open(image_path, "wb") as f:
+            f.write(jpeg_bytes)
+        file_paths.append(image_path)
 
     print(f"PDF converted to images with fixed length {fixed_length}px and saved to: {output_dir}")
     return output_dir, file_paths
 
+def pdf_to_base64_images(pdf, fixed_length=1080, debug_dir=None, base_name="page", max_workers=None,
+                         policy=None, pages=None):
+    """Yield one base64 JPEG payload per page, in page order, without touching the disk.
+
+    A tiled page yields a list of payloads. With debug_dir set, each page is also written
+    there as {base_name}_page_{n}.jpg (or _page_{n}_tile_{k}.jpg). pages restricts the
+    output to those page numbers.
+    """
+    if debug_dir:
+        os.makedirs(debug_dir, exist_ok=True)
+    page_numbers = pages if pages is not None else range(get_page_count(pdf))
+    rendered_pages = iter(render_pdf_pages(pdf, fixed_length, max_workers, policy=policy, pages=page_numbers))
+    for page_number in page_numbers:
+        # Rasterizing and JPEG encoding happen in the render pool; this is the wait for them
+        with stage_timer("render"):
+            rendered = next(rendered_pages)
+        tiles = rendered if isinstance(rendered, list) else [rendered]
+        if debug_dir:
+            for tile_number, jpeg_bytes in enumerate(tiles):
+                suffix = f"_tile_{tile_number + 1}" if isinstance(rendered, list) else ""
+                image_path = os.path.join(debug_dir, f"{base_name}_page_{page_number + 1}{suffix}.jpg")
+                with open(image_path, "wb") as f:
+                    f.write(jpeg_bytes)
+        with stage_timer("encode"):
+            encoded = [base64.b64encode(jpeg_bytes).decode("utf-8") for jpeg_bytes in tiles]
+        yield encoded if isinstance(rendered, list) else encoded[0]
+
 # API Call function
-async def make_api_call(base64_image, prompt, schema, base_url, api_key):
-    client = openai.AsyncClient(base_url= base_url, api_key=api_key)
-    model_list = await client.models.list()
-    model = model_list.data[0].id
-    completion = await client.chat.completions.create(
-        model=model,
-        messages=[
-            {
-                "role": "user",
-                "content": [{"type": "text", "text": prompt},
-                            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}]
-            }
-        ],
-        response_format={
-            "type": "json_schema",
-            "json_schema": {
-                "name": "metadata_and_sample_data",
-                "schema": schema.model_json_schema()
-            },
+def build_messages(images, prompt):
+    # Images first, then the prompt: table prompts start with the shared table_preamble, so
+    # calls for the same page share the longest possible prefix in vLLM's prefix cache
+    return [
+        {
+            "role": "user",
+            "content": [
+                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image}"}}
+                for image in images
+            ] + [{"type": "text", "text": prompt}]
         }
+    ]
+
+@lru_cache(maxsize=None)
+def response_format(schema):
+    # Built once per schema class; model_json_schema() walks the whole model on every call
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "metadata_and_sample_data",
+            "schema": schema.model_json_schema()
+        },
+    }
+
+async def make_api_call(base64_image, prompt, schema, base_url, api_key, use_cache=True, prefill_done=None,
+                        usage=None):
+    """Send one page to the model and return its answer as a validated schema instance.
+
+    With prefill_done (an asyncio.Event) the answer is streamed and the event is set as soon
+    as the first token arrives, i.e. once the server has prefilled (and prefix-cached) the
+    image and prompt. If given, usage is updated in place with prompt_tokens,
+    completion_tokens and cached (answered from the page cache).
+    """
+    # Reuse the pooled client and the cached model id instead of reconnecting per call
+    client = client_manager.get_client(base_url, api_key)
+    model = await client_manager.get_model_id(base_url, api_key)
+
+    # A tiled page is a list of images sent together in one request
+    images = base64_image if isinstance(base64_image, list) else [base64_image]
+
+    # Unchanged pages of re-submitted reports are answered from the on-disk cache
+    use_cache = use_cache and page_cache.enabled
+    if use_cache:
+        # Hashing the images and the SQLite I/O stay off the event loop
+        cache_key = await asyncio.to_thread(
+            page_cache.make_key, "\0".join(images), prompt, schema_json(schema), model
+        )
+        cached = await asyncio.to_thread(page_cache.get, cache_key)
+        record_cache_lookup(cached is not None)
+        if cached is not None:
+            if usage is not None:
+                usage["cached"] = True
+            if prefill_done:
+                prefill_done.set()
+            return schema.model_validate_json(cached)
+
+    request = dict(
+        model=model,
+        messages=build_messages(images, prompt),
+        response_format=response_format(schema)
+    )
+    try:
+        if prefill_done is None:
+            completion = await client.chat.completions.create(**request)
+            content = completion.choices[0].message.content
+            completion_usage = completion.usage
+        else:
+            parts = []
+            completion_usage = None
+            # The last chunk carries the usage and no choices
+            async for chunk in await client.chat.completions.create(
+                stream=True, stream_options={"include_usage": True}, **request
+            ):
+                prefill_done.set()
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                if chunk.usage is not None:
+                    completion_usage = chunk.usage
+            content = "".join(parts)
+    except openai.NotFoundError:
+        # The served model may have been redeployed under another name; look it up again
+        # on the next attempt instead of waiting for MODEL_ID_TTL
+        client_manager.invalidate_model_id(base_url, api_key)
+        raise
+    record_usage(schema.__name__, completion_usage)
+    if usage is not None and completion_usage is not None:
+        usage["prompt_tokens"] = completion_usage.prompt_tokens
+        usage["completion_tokens"] = completion_usage.completion_tokens
+    # Parsed and validated in one pass; raises ValidationError for malformed answers, which
+    # are never cached
+    result = schema.model_validate_json(content)
+    if use_cache:
+        await asyncio.to_thread(page_cache.put, cache_key, content)
+    return result
+
+# Retry policy for call_model: per-attempt timeout (seconds), attempts for transient errors
+# (timeouts, connection errors, 404 for a stale model id, 429 and 5xx), and repair retries
+# for answers that fail schema validation
+CALL_TIMEOUT = 300.0
+MAX_CALL_ATTEMPTS = 4
+MAX_REPAIR_ATTEMPTS = 1
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+def is_retryable(error):
+    # A 404 usually means a stale model id, which make_api_call has just invalidated
+    if isinstance(error, (asyncio.TimeoutError, openai.APIConnectionError, openai.NotFoundError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and (
+        error.status_code in RETRYABLE_STATUS_CODES or error.status_code >= 500
     )
-    return completion.choices[0].message.content
-
-# Batch processing function
-async def process_images_in_batches(images, base_url, api_key):
-    soil_data = []
-    sample_data = []
-
-    # Process images in batches of 10
-    for i in range(0, len(images), 10):
-        batch = images[i:i+10]
-        
-        # First API call for soil data (prompt_soil_data)
-        soil_tasks = [make_api_call(image, prompt_soil_data, MetadataAndSoilData, base_url, api_key) for image in batch]
-        soil_results = await asyncio.gather(*soil_tasks)
-        soil_results = [json.loads(result) for result in soil_results]
-        soil_data.extend(soil_results)
-        
-        # Second API call for sample data (prompt_sample_data)
-        sample_tasks = [make_api_call(image, prompt_sample_data, MetadataAndSampleData, base_url, api_key) for image in batch]
-        sample_results = await asyncio.gather(*sample_tasks)
-        sample_results = [json.loads(result) for result in sample_results]
-        sample_data.extend(sample_results)
-        print(f"batch {i} done")
 
+def backoff_delay(attempt, error=None):
+    # Full jitter exponential backoff, but never shorter than a server's Retry-After
+    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+    if isinstance(error, openai.APIStatusError):
+        try:
+            delay = max(delay, float(error.response.headers.get("retry-after", 0)))
+        except ValueError:
+            pass
+    return delay
+
+def describe_validation_error(error, max_errors=5):
+    return "; ".join(
+        f"{'.'.join(map(str, err['loc'])) or 'answer'}: {err['msg']}" for err in error.errors()[:max_errors]
+    )
+
+def backend_route(base_url, api_key, affinity):
+    # base_url is a single endpoint or a BackendPool that picks one per call
+    if hasattr(base_url, "route"):
+        return base_url.route(affinity)
+    return nullcontext(Backend(base_url, api_key))
+
+def limiter_slot(call_limiter, key):
+    # AdaptiveLimiter tracks latency per kind of call; a plain Semaphore is used as is
+    if hasattr(call_limiter, "slot"):
+        return call_limiter.slot(key)
+    return call_limiter or nullcontext()
+
+# Base64 characters decoded to read an image's size; a JPEG header ends well inside them
+IMAGE_HEADER_CHARS = 4096
+
+def image_size(base64_image):
+    # [width, height] of a page image, or one pair per tile of a tiled page. Only the header
+    # is decoded: a 4000px page is megabytes of base64, and this runs on the event loop
+    if isinstance(base64_image, list):
+        return [image_size(image) for image in base64_image]
+    try:
+        return list(Image.open(BytesIO(base64.b64decode(base64_image[:IMAGE_HEADER_CHARS]))).size)
+    except OSError:
+        # Unusually long header (e.g. large embedded metadata)
+        return list(Image.open(BytesIO(base64.b64decode(base64_image))).size)
+
+async def call_model(base64_image, prompt, schema, base_url, api_key, use_cache=True, call_limiter=None,
+                     timeout=CALL_TIMEOUT, prefill_done=None, affinity=None, call_log=None, log_fields=None):
+    """make_api_call with a timeout, backoff retries and a repair retry for invalid answers.
+
+    call_limiter is held only while a request is in flight, not during backoff. base_url may
+    be a BackendPool, in which case every attempt is routed separately and calls with the
+    same affinity key go to the same backend. Returns the answer as a schema instance; raises
+    the last error once the attempts are used up. With call_log (a list), a record of every
+    attempt is appended: log_fields plus schema, attempt, backend, image_size, latency_s,
+    prompt_tokens, completion_tokens, cached and error.
+    """
+    attempt = 0
+    repairs = 0
+    request_prompt = prompt
+    size = image_size(base64_image) if call_log is not None else None
+    while True:
+        usage = {}
+        backend_url = None
+        error = None
+        start = time.perf_counter()
+        try:
+            try:
+                async with limiter_slot(call_limiter, schema.__name__) as slot:
+                    async with backend_route(base_url, api_key, affinity) as backend:
+                        backend_url = backend.base_url
+                        with span("model_call", schema=schema.__name__, backend=backend_url, attempt=attempt):
+                            request_start = time.perf_counter()
+                            try:
+                                with MODEL_CALLS_IN_FLIGHT.track_inprogress():
+                                    content = await asyncio.wait_for(make_api_call(
+                                        base64_image, request_prompt, schema, backend_url, backend.api_key,
+                                        use_cache, prefill_done, usage
+                                    ), timeout)
+                            except Exception as e:
+                                record_model_call(schema.__name__, time.perf_counter() - request_start, e)
+                                raise
+                            record_model_call(schema.__name__, time.perf_counter() - request_start)
+                            if usage.get("cached") and hasattr(slot, "cached"):
+                                # A page cache hit says nothing about the server's latency
+                                slot.cached = True
+                            return content
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                # Latency includes the wait for a call_limiter slot, i.e. what the page saw
+                if call_log is not None and not isinstance(error, asyncio.CancelledError):
+                    call_log.append({
+                        **(log_fields or {}),
+                        "schema": schema.__name__,
+                        "attempt": attempt + repairs,
+                        "backend": backend_url,
+                        "image_size": size,
+                        "latency_s": round(time.perf_counter() - start, 3),
+                        "prompt_tokens": usage.get("prompt_tokens"),
+                        "completion_tokens": usage.get("completion_tokens"),
+                        "cached": usage.get("cached", False),
+                        "error": describe_error(error) if error else None,
+                    })
+        except ValidationError as e:
+            if repairs >= MAX_REPAIR_ATTEMPTS:
+                raise
+            repairs += 1
+            print(f"Invalid model answer, asking again: {describe_validation_error(e)}")
+            request_prompt = prompt + repair_note.format(errors=describe_validation_error(e))
+        except Exception as e:
+            attempt += 1
+            if not is_retryable(e) or attempt >= MAX_CALL_ATTEMPTS:
+                raise
+            delay = backoff_delay(attempt, e)
+            print(f"Model call failed ({type(e).__name__}), retry {attempt} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+def describe_error(error):
+    return f"{type(error).__name__}: {error}" if str(error) else type(error).__name__
+
+# Number of model calls kept in flight at once; matches vLLM's --max-num-seqs in ngrok.py
+DEFAULT_MAX_CONCURRENCY = 16
+
+# (kind, prompt, schema) for every extraction call made per page, by extraction mode.
+# "two_call" sends each page twice; "combined" gets soil and sample data in one request,
+# which halves image prefill on the vision model.
+EXTRACTION_MODES = {
+    "two_call": [
+        ("soil", prompt_soil_data, MetadataAndSoilData),
+        ("sample", prompt_sample_data, MetadataAndSampleData),
+    ],
+    "combined": [
+        ("combined", prompt_combined_data, MetadataAndTableData),
+    ],
+}
+DEFAULT_EXTRACTION_MODE = "two_call"
+# The same calls without metadata, for pages whose metadata was read from the text layer
+ROWS_ONLY_MODES = {
+    "two_call": [
+        ("soil", prompt_soil_rows, SoilRows),
+        ("sample", prompt_sample_rows, SampleRows),
+    ],
+    "combined": [
+        ("combined", prompt_combined_rows, TableRows),
+    ],
+}
+
+# Split a combined page result into the soil and sample entries merge_data expects
+def split_combined_result(result):
+    return (
+        {"metadata": result["metadata"], "soil_data": result["soil_data"]},
+        {"metadata": result["metadata"], "sample_data": result["sample_data"]},
+    )
+
+# Rendered pages buffered ahead of the model calls; bounds peak memory while streaming
+DEFAULT_RENDER_QUEUE_DEPTH = 8
+
+async def render_pages_async(pdf, fixed_length=1080, queue_depth=DEFAULT_RENDER_QUEUE_DEPTH, **render_kwargs):
+    """Async generator of base64 page images rendered off the event loop.
+
+    Pages pass through a queue of queue_depth entries, so rendering pauses (backpressure)
+    while the model calls fall behind instead of holding the whole document in memory.
+    """
+    pages = iter(pdf_to_base64_images(pdf, fixed_length, **render_kwargs))
+    queue = asyncio.Queue(maxsize=queue_depth)
+    stopped = False
+    end = object()
+
+    async def produce():
+        # One page per thread hop: a thread is only held while a page renders, never while
+        # the queue is full, so many PDFs cannot starve the default executor
+        try:
+            while not stopped:
+                image = await asyncio.to_thread(next, pages, end)
+                if image is end:
+                    break
+                await queue.put((image, None))
+            item = (end, None)
+        except Exception as e:
+            item = (end, e)
+        if not stopped:
+            await queue.put(item)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            image, error = await queue.get()
+            if image is end:
+                if error:
+                    raise error
+                return
+            yield image
+    finally:
+        # Unblock a producer waiting on a full queue, let it finish its page and exit
+        stopped = True
+        while not queue.empty():
+            queue.get_nowait()
+        await producer
+        await asyncio.to_thread(pages.close)
+
+def page_affinity(image):
+    # Routing key for a page image: its calls, and re-submissions of the same page, go to
+    # the same backend and find the image in that server's prefix cache
+    return hash(image) if isinstance(image, str) else hash(tuple(image))
+
+async def iterate_images(images):
+    # Accept a plain list of pages as well as an async source like render_pages_async
+    if hasattr(images, "__aiter__"):
+        async for image in images:
+            yield image
+    else:
+        for image in images:
+            yield image
+
+# Streaming scheduler: yields (page_index, kind, result) as soon as each call completes.
+# kind is always "soil" or "sample"; combined results are split before being yielded.
+# A call that still fails after call_model's retries yields an error record
+# {"page_index", "kind", "error"} as its result instead of stopping the document.
+# page_headers[page_index] is an optional PageHeader (see scan_page_headers); page_headers
+# may also be a future of that list, which every page waits for before its calls. Pages whose
+# metadata is known from the text layer, and with reuse_hole_metadata every page repeating
+# an earlier page's header, get the rows-only calls; continuation pages take the metadata
+# of the first page of their borehole. Trusted text fields override the model's answer.
+# With pair_calls the second call of a two-call page is sent once the first has been
+# prefilled, so it reuses the cached image and preamble instead of prefilling them again.
+# call_log collects call_model's records, with the page_index and kind of each call.
+async def stream_page_results(images, base_url, api_key, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                              extraction_mode=DEFAULT_EXTRACTION_MODE, use_cache=True, call_limiter=None,
+                              page_headers=None, reuse_hole_metadata=False, pair_calls=False, call_log=None):
+    if extraction_mode not in EXTRACTION_MODES:
+        raise ValueError(f"Unknown extraction mode: {extraction_mode}")
+    calls = EXTRACTION_MODES[extraction_mode]
+    rows_only_calls = ROWS_ONLY_MODES[extraction_mode]
+    # call_limiter lets several documents share one cap on in-flight model calls
+    semaphore = call_limiter or asyncio.Semaphore(max_concurrency)
+    # Pages admitted ahead of the call window (one spare to cover stragglers). A slot is freed
+    # when all calls of its page finish, so an async source is pulled only as fast as it drains.
+    page_slots = asyncio.Semaphore(-(-max_concurrency // len(calls)) + 1)
+    # Metadata of the first page seen with each header key, resolved by its first result
+    hole_metadata = {}
+    results = asyncio.Queue()
+    tasks = set()
+    end = object()
+
+    async def run_call(page_index, image, call, full_call, header, metadata, prefill_done=None, after=None):
+        kind, prompt, schema = call
+        try:
+            if after:
+                await after.wait()
+            result = (await call_model(
+                image, prompt, schema, base_url, api_key, use_cache, semaphore, prefill_done=prefill_done,
+                affinity=page_affinity(image), call_log=call_log, log_fields={"page_index": page_index, "kind": kind}
+            )).model_dump()
+            if "metadata" in result:
+                result["metadata"].update(header.text_fields)
+                if metadata and not metadata.done():
+                    metadata.set_result(result["metadata"])
+            else:
+                # Rows-only call: wait for the metadata from the text layer or the hole's first page
+                try:
+                    known = await metadata
+                except Exception:
+                    # The hole's first page failed, so this page is asked for its own metadata
+                    return await run_call(page_index, image, full_call, full_call, header, None)
+                result = {"metadata": {**known, **header.text_fields}, **result}
+        except Exception as e:
+            # Record the failure and let the rest of the document complete
+            print(f"Page {page_index} {kind} extraction failed: {describe_error(e)}")
+            for output_kind in ("soil", "sample") if kind == "combined" else (kind,):
+                results.put_nowait((page_index, output_kind, {
+                    "page_index": page_index, "kind": output_kind, "error": describe_error(e)
+                }))
+            return
+        finally:
+            # Don't hold back the paired call if this one failed before its first token
+            if prefill_done:
+                prefill_done.set()
+        if kind == "combined":
+            soil_result, sample_result = split_combined_result(result)
+            results.put_nowait((page_index, "soil", soil_result))
+            results.put_nowait((page_index, "sample", sample_result))
+        else:
+            results.put_nowait((page_index, kind, result))
+
+    async def run_page(page_index, image):
+        headers = await page_headers if asyncio.isfuture(page_headers) else page_headers
+        header = headers[page_index] if headers else PageHeader()
+        metadata = None
+        page_calls = calls
+        if header.metadata:
+            metadata = asyncio.get_running_loop().create_future()
+            metadata.set_result(header.metadata)
+            page_calls = rows_only_calls
+        if reuse_hole_metadata and header.key is not None:
+            if header.key in hole_metadata:
+                metadata = hole_metadata[header.key]
+                page_calls = rows_only_calls
+            else:
+                hole_metadata[header.key] = metadata = metadata or asyncio.get_running_loop().create_future()
+        prefill_done = asyncio.Event() if pair_calls and len(page_calls) > 1 else None
+        try:
+            with span("page", page_index=page_index, rows_only=page_calls is rows_only_calls):
+                await asyncio.gather(*(
+                    run_call(page_index, image, call, full_call, header, metadata,
+                             prefill_done if i == 0 else None, prefill_done if i > 0 else None)
+                    for i, (call, full_call) in enumerate(zip(page_calls, calls))
+                ))
+            # Every call of a hole's first page failed; its continuation pages fall back
+            if metadata and not metadata.done():
+                metadata.set_exception(RuntimeError(f"No metadata for page {page_index}"))
+                metadata.exception()
+        finally:
+            page_slots.release()
+
+    async def feed():
+        try:
+            page_index = 0
+            async for image in iterate_images(images):
+                await page_slots.acquire()
+                tasks.add(asyncio.create_task(run_page(page_index, image)))
+                page_index += 1
+            await asyncio.gather(*tasks)
+        except Exception as e:
+            results.put_nowait(e)
+        finally:
+            results.put_nowait(end)
+
+    feeder = asyncio.create_task(feed())
+    try:
+        while True:
+            item = await results.get()
+            if item is end:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # Don't leave rendering or calls running if the consumer stops early or a call fails
+        feeder.cancel()
+        for task in tasks:
+            task.cancel()
+
+# Batch processing function; images may be a list or an async iterable of base64 pages.
+# on_result(page_index, kind) is called after every soil/sample result or failure, e.g. for
+# progress. Pages whose calls failed are left out of the results and their error records
+# are appended to page_errors when a list is given; call_log collects every model call's
+# usage record (see call_model). on_page_result(page_index, kind, result) receives every
+# result or error record as it arrives, e.g. for an IncrementalMerger.
+async def process_images_in_batches(images, base_url, api_key, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                                    extraction_mode=DEFAULT_EXTRACTION_MODE, use_cache=True, call_limiter=None,
+                                    on_result=None, page_headers=None, reuse_hole_metadata=False,
+                                    page_errors=None, pair_calls=False, call_log=None, on_page_result=None):
+    soil_by_page = {}
+    sample_by_page = {}
+
+    done = 0
+    async for page_index, kind, result in stream_page_results(
+        images, base_url, api_key, max_concurrency, extraction_mode, use_cache, call_limiter,
+        page_headers, reuse_hole_metadata, pair_calls, call_log
+    ):
+        if "error" in result:
+            PAGE_ERRORS.labels(kind).inc()
+            if page_errors is not None:
+                page_errors.append(result)
+        elif kind == "soil":
+            soil_by_page[page_index] = result
+        else:
+            sample_by_page[page_index] = result
+        if on_page_result:
+            on_page_result(page_index, kind, result)
+        if on_result:
+            on_result(page_index, kind)
+        done += 1
+        if done % 10 == 0:
+            print(f"{done} page results done")
+
+    # Results arrive out of order; sorting by page keeps the final output in page order
+    soil_data = [soil_by_page[i] for i in sorted(soil_by_page)]
+    sample_data = [sample_by_page[i] for i in sorted(sample_by_page)]
+    if page_errors:
+        page_errors.sort(key=lambda record: (record["page_index"], record["kind"]))
     return soil_data, sample_data
 
+# Thumbnail width for model-based page classification; a one-word answer needs few pixels
+CLASSIFY_THUMBNAIL_LENGTH = 768
+# A drill log has at least this many long vertical column lines
+MIN_TABLE_COLUMNS = 4
+# Pages with less vector and text content than this and no images are blank or near blank
+MIN_PAGE_DRAWINGS = 20
+MIN_PAGE_WORDS = 5
+
+def classify_page_heuristic(page, rules=None, column_tops=None):
+    # Cheap local page type from PyMuPDF content: "table", "other", or None when unsure
+    if rules is None or column_tops is None:
+        rules, column_tops = find_page_rules(page)
+    if len(column_tops) >= MIN_TABLE_COLUMNS and detect_page_regions(page, rules, column_tops):
+        return "table"
+    if (len(page.get_cdrawings()) < MIN_PAGE_DRAWINGS and not page.get_images()
+            and len(page.get_text("words")) < MIN_PAGE_WORDS):
+        return "other"
+    return None
+
+def scan_page_list(pdf, page_numbers, thumbnail_length=CLASSIFY_THUMBNAIL_LENGTH):
+    # Runs inside a pool worker: (heuristic label, JPEG thumbnail when the label is None,
+    # detect_page_regions result) for each page
+    thumbnail_policy = ResolutionPolicy(fixed_length=thumbnail_length)
+    doc = open_pdf(pdf)
+    try:
+        scanned = []
+        for page_number in page_numbers:
+            page = doc[page_number]
+            rules, column_tops = find_page_rules(page)
+            label = classify_page_heuristic(page, rules, column_tops)
+            thumbnail = render_region(page, page.rect, thumbnail_policy, JPEG_QUALITY) if label is None else None
+            scanned.append((label, thumbnail, detect_page_regions(page, rules, column_tops)))
+        return scanned
+    finally:
+        doc.close()
+
+def scan_page_types(pdf, thumbnail_length=CLASSIFY_THUMBNAIL_LENGTH, max_workers=None):
+    # Yield (page_number, heuristic label, thumbnail or None, regions) in page order, scanning
+    # page ranges in the render pool; the thumbnail is only rendered for undecided pages, and
+    # the regions save the header scan from finding the rules again
+    page_numbers = range(get_page_count(pdf))
+    scanned = map_page_ranges(scan_page_list, pdf, page_numbers, max_workers, thumbnail_length)
+    for page_number, (label, thumbnail, regions) in zip(page_numbers, scanned):
+        yield page_number, label, thumbnail, regions
+
+async def classify_pdf_pages(pdf, base_url, api_key, use_model=True, use_cache=True, call_limiter=None,
+                             max_concurrency=DEFAULT_MAX_CONCURRENCY, call_log=None, page_regions=None):
+    """Return "table", "map" or "other" for every page of the PDF.
+
+    Pages the local heuristic can't decide are classified by the model from a low-resolution
+    thumbnail with prompt_cls, as soon as their page range is scanned; with use_model=False,
+    or when that call fails, they are treated as tables. page_regions (a dict) is filled with
+    the detect_page_regions result of every page number, for scan_page_headers.
+    """
+    semaphore = call_limiter or asyncio.Semaphore(max_concurrency)
+    labels = []
+    calls = []
+
+    async def classify(page_number, thumbnail):
+        try:
+            result = await call_model(
+                base64.b64encode(thumbnail).decode("utf-8"), prompt_cls, PageClass, base_url, api_key, use_cache,
+                semaphore, call_log=call_log, log_fields={"page_number": page_number + 1, "kind": "classify"}
+            )
+            labels[page_number] = result.page_type
+        except Exception as e:
+            print(f"Page {page_number} classification failed, treating it as a table: {describe_error(e)}")
+            labels[page_number] = "table"
+
+    scanned = scan_page_types(pdf)
+    end = object()
+    try:
+        while True:
+            page = await asyncio.to_thread(next, scanned, end)
+            if page is end:
+                break
+            page_number, label, thumbnail, regions = page
+            if page_regions is not None:
+                page_regions[page_number] = regions
+            if label is None and use_model:
+                calls.append(asyncio.ensure_future(classify(page_number, thumbnail)))
+            labels.append(label or "table")
+        await asyncio.gather(*calls)
+    finally:
+        for call in calls:
+            call.cancel()
+        await asyncio.to_thread(scanned.close)
+    return labels
+
+async def extract_map_pages(pdf, page_numbers, base_url, api_key, policy=None, use_cache=True, call_limiter=None,
+                            max_concurrency=DEFAULT_MAX_CONCURRENCY, page_errors=None, call_log=None):
+    # Borehole names and levels (Borehole_data) from boring location map pages; failed
+    # pages are skipped and recorded in page_errors
+    if not page_numbers:
+        return []
+    images = await asyncio.to_thread(list, pdf_to_base64_images(pdf, policy=policy, pages=page_numbers))
+    semaphore = call_limiter or asyncio.Semaphore(max_concurrency)
+
+    async def extract(page_number, image):
+        try:
+            return (await call_model(
+                image, prompt_map, Borehole_data, base_url, api_key, use_cache, semaphore,
+                call_log=call_log, log_fields={"page_number": page_number + 1, "kind": "map"}
+            )).model_dump()
+        except Exception as e:
+            print(f"Page {page_number} map extraction failed: {describe_error(e)}")
+            PAGE_ERRORS.labels("map").inc()
+            if page_errors is not None:
+                page_errors.append({"page_number": page_number + 1, "kind": "map", "error": describe_error(e)})
+            return None
+
+    map_data = await asyncio.gather(*(extract(page_number, image) for page_number, image in zip(page_numbers, images)))
+    return [page for page in map_data if page is not None]
+
+# Width in pixels of the grayscale header rasters compared between consecutive pages
+HEADER_RASTER_WIDTH = 400
+# Largest per-pixel difference between two renders of the same header. CAD exports stroke
+# the same header slightly differently from page to page (differences stay under ~16),
+# while another HOLE No. or date changes some pixels by more than 100.
+HEADER_MAX_PIXEL_DIFF = 48
+
+@dataclass
+class PageHeader:
+    """What is known about a table page's metadata header before any model call.
+
+    text_fields are the Metadata fields read from the text layer with full confidence,
+    metadata the complete Metadata dict when every field was read, and key is shared by
+    consecutive pages with the same header, i.e. the pages of one borehole.
+    """
+    text_fields: dict = field(default_factory=dict)
+    metadata: Optional[dict] = None
+    key: Optional[int] = None
+
+def header_raster(page, header_region):
+    # The margin is cut off because sheet numbers ("1/2") sit just above the frame
+    inset = 2 * REGION_MARGIN
+    clip = fitz.Rect(header_region.x0, header_region.y0 + inset, header_region.x1, header_region.y1 - inset)
+    scale = HEADER_RASTER_WIDTH / clip.width
+    pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale), clip=clip, colorspace=fitz.csGRAY)
+    return pix.width, pix.height, pix.samples
+
+def same_header(raster, other):
+    if raster is None or other is None or raster[:2] != other[:2]:
+        return False
+    return all(abs(a - b) <= HEADER_MAX_PIXEL_DIFF for a, b in zip(raster[2], other[2]))
+
+def scan_page_headers(pdf, page_numbers=None, read_text=True, match_headers=True, page_regions=None):
+    """Return a PageHeader for each page in page_numbers (all pages by default).
+
+    With read_text the metadata header is read from the PDF text layer; pages without one
+    (scans, CAD exports drawn as strokes) keep empty text fields and stay on the vision path.
+    With match_headers a page whose header matches the previous page's gets that page's
+    key; the key is the page number of the first page of the run. page_regions maps page
+    numbers to detect_page_regions results that are already known (see classify_pdf_pages).
+    """
+    page_regions = page_regions or {}
+    doc = open_pdf(pdf)
+    try:
+        headers = []
+        previous = None
+        for page_number in range(doc.page_count) if page_numbers is None else page_numbers:
+            page = doc[page_number]
+            header = PageHeader()
+            words = page.get_text("words") if read_text else None
+            # Finding the frame means a full pass over the page's drawings; skip it when
+            # neither the header match nor a text layer needs it
+            regions = None
+            if match_headers or words:
+                regions = page_regions[page_number] if page_number in page_regions else detect_page_regions(page)
+            if match_headers and regions:
+                raster = header_raster(page, regions[1])
+                header.key = headers[-1].key if same_header(raster, previous) else page_number
+                previous = raster
+            else:
+                previous = None
+            if words:
+                fields, confidence = extract_text_metadata(page, regions[1] if regions else None)
+                header.text_fields = trusted_fields(fields, confidence)
+                header.metadata = complete_metadata(fields, confidence)
+            headers.append(header)
+        return headers
+    finally:
+        doc.close()
+
+async def extract_pdf(pdf, base_url, api_key, policy=None, classify_pages=True, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                      extraction_mode=DEFAULT_EXTRACTION_MODE, use_cache=True, call_limiter=None, on_result=None,
+                      on_page_types=None, use_text_layer=True, reuse_hole_metadata=False, page_errors=None,
+                      pair_calls=False, call_log=None, on_page_result=None, **render_kwargs):
+    """Classify, render and extract a whole PDF.
+
+    Table pages go through soil/sample extraction, map pages through Borehole_data
+    extraction and every other page is dropped. Returns (soil_data, sample_data, map_data,
+    page_types); page_types is None when classify_pages is off and every page is a table.
+    on_page_types(page_types) is called once classification is done. With use_text_layer,
+    metadata found in the PDF text layer replaces the model's metadata extraction, and with
+    reuse_hole_metadata only the first page of each borehole is asked for metadata.
+    Pages whose calls fail are left out and recorded in page_errors ({"page_number" (1-based),
+    "kind", "error"}) when a list is given. pair_calls staggers the two calls of a page so
+    the second one hits vLLM's prefix cache. call_log collects the usage record of every
+    model call (see call_model), with its 1-based page_number and kind. on_page_result is
+    passed to process_images_in_batches (page indices count table pages only).
+    """
+    # Classification, map and table calls all share one in-flight cap
+    call_limiter = call_limiter or asyncio.Semaphore(max_concurrency)
+    page_types = None
+    table_pages = None
+    map_pages = []
+    page_regions = {}
+    if classify_pages:
+        with stage("classify"):
+            page_types = await classify_pdf_pages(
+                pdf, base_url, api_key, use_cache=use_cache, call_limiter=call_limiter, call_log=call_log,
+                page_regions=page_regions
+            )
+        table_pages = [page_number for page_number, page_type in enumerate(page_types) if page_type == "table"]
+        map_pages = [page_number for page_number, page_type in enumerate(page_types) if page_type == "map"]
+    if on_page_types:
+        on_page_types(page_types)
+
+    async def scan_headers():
+        try:
+            with stage("header_scan"):
+                headers = await asyncio.to_thread(
+                    scan_page_headers, pdf, table_pages, use_text_layer, reuse_hole_metadata, page_regions
+                )
+        except Exception as e:
+            print(f"Header scan failed, every page goes to the model whole: {describe_error(e)}")
+            return None
+        text_pages = sum(1 for header in headers if header.metadata)
+        if text_pages:
+            print(f"Metadata read from the text layer for {text_pages}/{len(headers)} table pages")
+        if reuse_hole_metadata:
+            holes = len({header.key for header in headers if header.key is not None})
+            print(f"{len(headers)} table pages, {holes} distinct borehole headers")
+        return headers
+
+    # The header scan runs while the first pages render; pages wait for it before their calls
+    page_headers = asyncio.ensure_future(scan_headers()) if use_text_layer or reuse_hole_metadata else None
+
+    table_errors = []
+    map_errors = []
+    table_calls = [] if call_log is not None else None
+    pages = render_pages_async(pdf, policy=policy, pages=table_pages, **render_kwargs)
+    (soil_data, sample_data), map_data = await asyncio.gather(
+        process_images_in_batches(
+            pages, base_url, api_key, max_concurrency=max_concurrency, extraction_mode=extraction_mode,
+            use_cache=use_cache, call_limiter=call_limiter, on_result=on_result,
+            page_headers=page_headers, reuse_hole_metadata=reuse_hole_metadata, page_errors=table_errors,
+            pair_calls=pair_calls, call_log=table_calls, on_page_result=on_page_result
+        ),
+        extract_map_pages(
+            pdf, map_pages, base_url, api_key, policy=policy, use_cache=use_cache, call_limiter=call_limiter,
+            page_errors=map_errors, call_log=call_log
+        ),
+    )
+    if page_headers is not None:
+        # Pages await the scan, but a PDF without table pages may finish before it does
+        await page_headers
+    if call_log is not None:
+        for record in table_calls:
+            page_index = record.pop("page_index")
+            page_number = (table_pages[page_index] if table_pages is not None else page_index) + 1
+            call_log.append({"page_number": page_number, **record})
+    if page_errors is not None:
+        for i, record in enumerate(table_errors):
+            page_index = record["page_index"]
+            table_errors[i] = {
+                "page_number": (table_pages[page_index] if table_pages is not None else page_index) + 1,
+                "kind": record["kind"],
+                "error": record["error"],
+            }
+        page_errors.extend(sorted(table_errors + map_errors, key=lambda record: record["page_number"]))
+    return soil_data, sample_data, map_data, page_types
+
 # Merge pages with same borehole
 def merge_data(soil_data: List[dict], sample_data: List[dict], debug: bool = False):
     merged_soil_data = defaultdict(list)
@@ -186,6 +1157,9 @@ def merge_data(soil_data: List[dict], sample_data: List[dict], debug: bool = Fal
         if debug:
             print(f"Merged sample_data for HOLE_NO: {hole_no}, total entries: {len(all_samples)}")
 
+    # Parse every sample's Hits once, here, instead of in each consumer
+    annotate_hits([sample for entry in final_merged_sample_data for sample in entry['sample_data']])
+
     if debug:
         print("merge_data function completed")
         print(f"Final merged soil_data length: {len(final_merged_soil_data)}")
@@ -194,59 +1168,88 @@ def merge_data(soil_data: List[dict], sample_data: List[dict], debug: bool = Fal
     return final_merged_soil_data, final_merged_sample_data
 # Function to extract the numeric values from the depth range string
 def extract_depth_range(depth_range: str):
-    # Remove trailing 'm' if present and strip spaces
-    cleaned = depth_range.strip().rstrip('m').replace(' ', '')
+    # Non-string or malformed ranges give (None, None) instead of raising
+    if not isinstance(depth_range, str):
+        return None, None
+    # Remove trailing 'm' if present and strip spaces; full-width tildes count as '~'
+    cleaned = depth_range.strip().rstrip('m').replace(' ', '').replace('～', '~')
     
     # Split by '~'
     if '~' in cleaned:
         parts = cleaned.split('~')
         try:
-            min_depth = float(parts[0])
+            min_depth = float(parts[0].rstrip('m'))
             max_depth = float(parts[1])
-            return min_depth, max_depth
-        except ValueError:
+            # A range written bottom first is still the same layer
+            return min(min_depth, max_depth), max(min_depth, max_depth)
+        except (ValueError, IndexError):
             return None, None  # Could not convert to float
     return None, None  # Invalid format
+
+# Which ends of a layer's depth range take a sample lying exactly on them, as in
+# pandas.Interval(closed=...): "both" puts a sample on a shared boundary into both layers,
+# "left" only into the deeper one ([top, bottom)) and "right" only into the shallower one
+# ((top, bottom]).
+DEPTH_BOUNDARY = "both"
+
+def sample_depth(sample):
+    try:
+        return float(sample['Depth'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def depth_slice(depths, depth_min, depth_max, closed=DEPTH_BOUNDARY):
+    # Index range of the sorted depths inside [depth_min, depth_max] with the given closed ends
+    start = bisect_left(depths, depth_min) if closed in ("both", "left") else bisect_right(depths, depth_min)
+    end = bisect_right(depths, depth_max) if closed in ("both", "right") else bisect_left(depths, depth_max)
+    return start, max(start, end)
+
 # Merge function that combines soil and sample data
-def merge_soil_and_sample_data(soil_data, sample_data):
+def merge_soil_and_sample_data(soil_data, sample_data, closed=DEPTH_BOUNDARY):
+    """Attach to every soil layer the samples of its hole whose Depth lies in its depth_range.
 
-    # Create a dictionary to group samples by HOLE_NO for easy lookup
+    Samples are sorted by depth once per hole and each layer takes its slice by binary
+    search, so overlapping layers share samples and samples in gaps between layers are
+    left out. Layers with an unparsable depth_range and samples without a numeric Depth
+    get no match instead of failing the merge. closed is the boundary convention (see
+    DEPTH_BOUNDARY). The soil layer dicts are updated in place with a 'samples' list.
+    """
+    if closed not in ("both", "left", "right"):
+        raise ValueError(f"Unknown boundary convention: {closed}")
+
+    # Samples of every HOLE_NO sorted by depth, with the depths as a separate search key
     sample_grouped_by_hole = {}
     for entry in sample_data:
         hole_no = entry['metadata']['HOLE_NO']
-        if hole_no not in sample_grouped_by_hole:
-            sample_grouped_by_hole[hole_no] = []
-        sample_grouped_by_hole[hole_no].extend(entry['sample_data'])
+        samples = sample_grouped_by_hole.setdefault(hole_no, [])
+        for sample in entry['sample_data']:
+            depth = sample_depth(sample)
+            if depth is None:
+                print(f"Skipping sample without a numeric depth in HOLE_NO {hole_no}: {sample}")
+                continue
+            samples.append((depth, sample))
+    sorted_by_hole = {}
+    for hole_no, samples in sample_grouped_by_hole.items():
+        samples.sort(key=lambda item: item[0])
+        sorted_by_hole[hole_no] = ([depth for depth, _ in samples], [sample for _, sample in samples])
 
-    # Now we merge the sample data into the soil data
     merged_data = []
-
     for soil_entry in soil_data:
         hole_no = soil_entry['metadata']['HOLE_NO']
-        soil_data = soil_entry['soil_data']
-
-        # Get the corresponding samples for the current HOLE_NO
-        samples_for_hole = sample_grouped_by_hole.get(hole_no, [])
-
-        # Now we need to filter samples based on the soil depth_range
-        for soil in soil_data:
-            soil_depth_min, soil_depth_max = extract_depth_range(soil['depth_range'])
+        depths, samples = sorted_by_hole.get(hole_no, ([], []))
 
-            # Filter samples that match the soil's depth range
-            matching_samples = [
-                sample for sample in samples_for_hole
-                if soil_depth_min <= sample['Depth'] <= soil_depth_max
-            ]
-
-            # Add the matching samples to the soil data
-            soil['samples'] = matching_samples
+        for soil in soil_entry['soil_data']:
+            soil_depth_min, soil_depth_max = extract_depth_range(soil.get('depth_range'))
+            if soil_depth_min is None:
+                print(f"Unparsable depth_range {soil.get('depth_range')!r} in HOLE_NO {hole_no}; no samples attached")
+                soil['samples'] = []
+                continue
+            start, end = depth_slice(depths, soil_depth_min, soil_depth_max, closed)
+            soil['samples'] = samples[start:end]
 
         merged_data.append({
             'metadata': soil_entry['metadata'],
-            'soil_data': soil_data
+            'soil_data': soil_entry['soil_data']
         })
 
     return merged_data
-
-
-
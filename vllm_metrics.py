@@ -0,0 +1,79 @@
+import asyncio
+import re
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+METRIC_LINE = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{[^}]*\})?\s+(\S+)", re.MULTILINE)
+
+# Prefix cache counters (vLLM V1) and the hit-rate gauge older vLLM versions export instead
+PREFIX_CACHE_QUERIES = "vllm:prefix_cache_queries_total"
+PREFIX_CACHE_HITS = "vllm:prefix_cache_hits_total"
+PREFIX_CACHE_HIT_RATE = "vllm:gpu_prefix_cache_hit_rate"
+REQUESTS_WAITING = "vllm:num_requests_waiting"
+
+
+def metrics_url_for(base_url: str) -> str:
+    # vLLM serves /metrics at the root, next to the OpenAI /v1 routes
+    parts = urlsplit(base_url)
+    return f"{parts.scheme}://{parts.netloc}/metrics"
+
+
+def parse_metrics(text: str) -> Dict[str, float]:
+    # Prometheus text format, summed over labels (e.g. one series per model name)
+    metrics = {}
+    for name, value in METRIC_LINE.findall(text):
+        try:
+            metrics[name] = metrics.get(name, 0.0) + float(value)
+        except ValueError:
+            continue
+    return metrics
+
+
+async def fetch_metrics(metrics_url: str, client: Optional[httpx.AsyncClient] = None,
+                        timeout: float = 5.0) -> Dict[str, float]:
+    if client is None:
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            return await fetch_metrics(metrics_url, client)
+    response = await client.get(metrics_url)
+    response.raise_for_status()
+    return parse_metrics(response.text)
+
+
+def prefix_cache_stats(metrics: Dict[str, float], since: Optional[Dict[str, float]] = None) -> Optional[dict]:
+    """Prefix cache hit rate from a metrics snapshot, or over the interval since an earlier one.
+
+    Hits and queries are counted in tokens. Returns None when the server exports neither
+    the counters nor the hit-rate gauge.
+    """
+    if PREFIX_CACHE_QUERIES in metrics:
+        queries = metrics[PREFIX_CACHE_QUERIES] - (since or {}).get(PREFIX_CACHE_QUERIES, 0.0)
+        hits = metrics.get(PREFIX_CACHE_HITS, 0.0) - (since or {}).get(PREFIX_CACHE_HITS, 0.0)
+        return {
+            "queried_tokens": int(queries),
+            "hit_tokens": int(hits),
+            "hit_rate": round(hits / queries, 4) if queries else 0.0,
+        }
+    if PREFIX_CACHE_HIT_RATE in metrics:
+        return {"hit_rate": round(metrics[PREFIX_CACHE_HIT_RATE], 4)}
+    return None
+
+
+async def fetch_combined_metrics(metrics_urls: List[str], client: Optional[httpx.AsyncClient] = None,
+                                 timeout: float = 5.0) -> Dict[str, float]:
+    # Metrics summed over several servers (a BackendPool); servers that can't be reached are
+    # skipped, and the last error is raised only when none could be read
+    if client is None:
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            return await fetch_combined_metrics(metrics_urls, client)
+    results = await asyncio.gather(*(fetch_metrics(url, client) for url in metrics_urls), return_exceptions=True)
+    combined = {}
+    for result in results:
+        if isinstance(result, Exception):
+            continue
+        for name, value in result.items():
+            combined[name] = combined.get(name, 0.0) + value
+    if not combined and results and isinstance(results[-1], Exception):
+        raise results[-1]
+    return combined